@@ -1,10 +1,4 @@
-def get_person_request(req_df, person_id):
-    street_vehicle_id = "body-%s" % (person_id)
-#     filtered_df = req_df[(req_df['streetVehicle_0_id'] == street_vehicle_id) | (req_df['streetVehicle_0_id'] == person_id) |
-#                          (req_df['streetVehicle_1_id'] == street_vehicle_id) | (req_df['streetVehicle_1_id'] == person_id) |
-#                          (req_df['streetVehicle_2_id'] == street_vehicle_id) | (req_df['streetVehicle_2_id'] == person_id)]
-    filtered_df = req_df[(req_df['streetVehicle_0_id'].str.contains(person_id)) |
-                         (req_df['streetVehicle_1_id'].str.contains(person_id)) |
-                         (req_df['streetVehicle_2_id'].str.contains(person_id))]
-    filtered_df = filtered_df.sort_values(by=['departureTime'])
-    return filtered_df
\ No newline at end of file
+# person index of routing requests is implemented once in tools.routing,
+# it works with both string tables (pd.read_csv) and typed tables (tools.routing.load_routing_requests)
+from tools.routing import person_requests_indices, build_person_requests_index, get_person_requests_index, \
+    get_person_request, get_persons_requests
@@ -0,0 +1,86 @@
+import functools
+import os
+import threading
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tools import cache, events
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """
+    static files with byte ranges. ranges starting at server.fail_from or later are answered with
+    the whole (empty) file instead of the range, the same as a server which does not support ranges
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def log_request(self, code='-', size='-'):
+        self.server.requests.append((self.command, self.path))
+
+    def end_headers(self):
+        self.send_header('Accept-Ranges', 'bytes')
+        super().end_headers()
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get('Range')
+        if range_header is None or not os.path.isfile(path):
+            return super().do_GET()
+
+        start, end = (int(value) for value in range_header.split('=')[1].split('-'))
+        if start >= self.server.fail_from:
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with open(path, 'rb') as served_file:
+            served_file.seek(start)
+            data = served_file.read(end - start + 1)
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, start + len(data) - 1, os.path.getsize(path)))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def local_cache(tmp_path, monkeypatch):
+    """
+    empty cache and events sidecar directories inside tmp_path
+    """
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path / 'cache'))
+    monkeypatch.setattr(events, 'events_datasets_dir', str(tmp_path / 'events'))
+    return tmp_path / 'cache'
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """
+    http server of tmp_path / 'served' with `directory`, `url` and `requests` (method and path of every request)
+    attributes.
+    files are sent with Last-Modified and revalidated by If-Modified-Since, byte ranges are supported.
+    """
+    directory = tmp_path / 'served'
+    directory.mkdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(RangeHandler, directory=str(directory)))
+    server.directory = directory
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.fail_from = float('inf')
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_dir(http_server):
+    """
+    (directory, url of it) served over http, see http_server
+    """
+    return http_server.directory, http_server.url
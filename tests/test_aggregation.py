@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.aggregation import StreamingGroupBy, aggregate_chunks
+
+aggregations = {
+    'total': ('volume', 'sum'),
+    'rows': ('volume', 'count'),
+    'average': ('volume', 'mean'),
+    'smallest': ('volume', 'min'),
+    'largest': ('volume', 'max'),
+    'first_link': ('link', 'first'),
+    'links': ('link', 'list'),
+}
+
+
+def make_chunks():
+    first = pd.DataFrame({'hour': [1, 0, 1], 'link': [10, 11, 12], 'volume': [1.0, 2.0, None]})
+    return [first, first.iloc[:0], pd.DataFrame({'hour': [0, 2, 1], 'link': [13, 14, 15], 'volume': [4.0, 5.0, 6.0]})]
+
+
+def test_aggregate_chunks():
+    chunks = make_chunks()
+    result = aggregate_chunks(chunks, 'hour', aggregations)
+    assert list(result.index) == [0, 1, 2]
+    assert list(result.columns) == list(aggregations)
+    assert result['total'].tolist() == [6.0, 7.0, 5.0]
+    assert result['rows'].tolist() == [2, 2, 1]
+    assert result['average'].tolist() == [3.0, 3.5, 5.0]
+    assert result['smallest'].tolist() == [2.0, 1.0, 5.0]
+    assert result['largest'].tolist() == [4.0, 6.0, 5.0]
+    assert result['first_link'].tolist() == [11, 10, 14]
+    assert result['links'].tolist() == [[11, 13], [10, 12, 15], [14]]
+
+    # the same as aggregation of all rows at once
+    expected = pd.concat(chunks).groupby('hour').agg(total=('volume', 'sum'), average=('volume', 'mean'))
+    pd.testing.assert_frame_equal(result[['total', 'average']], expected, check_dtype=False)
+
+
+def test_merge():
+    chunks = make_chunks()
+    group_by = StreamingGroupBy(['hour', 'link'], {'total': ('volume', 'sum')}).update(chunks[0])
+    other = StreamingGroupBy(['hour', 'link'], {'total': ('volume', 'sum')}).update(chunks[2])
+    empty = StreamingGroupBy(['hour', 'link'], {'total': ('volume', 'sum')})
+    result = group_by.merge(other).merge(empty).result()
+    assert result.index.names == ['hour', 'link']
+    assert result.index.tolist() == [(0, 11), (0, 13), (1, 10), (1, 12), (1, 15), (2, 14)]
+
+    assert empty.merge(group_by).result()['total'].sum() == 18.0
+
+
+def test_many_chunks():
+    rng = np.random.default_rng(0)
+    chunks = [pd.DataFrame({'person': rng.integers(0, 50, rows), 'time': rng.random(rows)})
+              for rows in [200, 1, 3, 0, 100, 2, 5, 300, 1]]
+    group_by = StreamingGroupBy('person', {'total': ('time', 'sum'), 'first_time': ('time', 'first'),
+                                           'latest': ('time', 'max'), 'average': ('time', 'mean')})
+    for chunk in chunks:
+        group_by.update(chunk)
+        # small chunks are buffered instead of regrouping the whole state every time
+        assert group_by.pending_rows < max(len(group_by.state), 1)
+
+    expected = pd.concat(chunks).groupby('person').agg(total=('time', 'sum'), first_time=('time', 'first'),
+                                                        latest=('time', 'max'), average=('time', 'mean'))
+    pd.testing.assert_frame_equal(group_by.result(), expected)
+
+
+def test_no_chunks():
+    result = aggregate_chunks([], 'hour', aggregations)
+    assert len(result) == 0 and list(result.columns) == list(aggregations)
+
+
+def test_unknown_aggregation():
+    with pytest.raises(ValueError):
+        StreamingGroupBy('hour', {'median': ('volume', 'median')})
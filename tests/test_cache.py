@@ -0,0 +1,31 @@
+import os
+
+from tools import cache
+
+
+def test_json_url_is_cached_and_evicted(local_cache, http_dir):
+    directory, url = http_dir
+    (directory / 'config.json').write_text('{"a": 1}')
+
+    cache.mark_immutable(url + '/run')
+    local_path = cache.cached_path(url + '/config.json')
+    with open(local_path) as cached_file:
+        assert cached_file.read() == '{"a": 1}'
+    assert local_path in cache.get_cache_entries()
+
+    cache.clear()
+    assert not os.path.exists(local_path)
+    # the cache's own files are kept
+    assert cache.get_immutable_prefixes() == [url + '/run']
+
+
+def test_cached_copy_is_revalidated(local_cache, http_dir):
+    directory, url = http_dir
+    served_path = directory / 'linkstats.csv'
+    served_path.write_text('old')
+    os.utime(served_path, (1000000, 1000000))
+    assert open(cache.cached_path(url + '/linkstats.csv')).read() == 'old'
+
+    served_path.write_text('new')
+    os.utime(served_path, (2000000, 2000000))
+    assert open(cache.cached_path(url + '/linkstats.csv')).read() == 'new'
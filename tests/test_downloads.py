@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from tools import cache, downloads
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    monkeypatch.setattr(downloads, 'segment_size', 1000)
+    monkeypatch.setattr(downloads, 'parallel_segments', 2)
+
+
+def write_served_file(http_server, size):
+    data = bytes(range(256)) * (size // 256)
+    (http_server.directory / 'events.bin').write_bytes(data)
+    return http_server.url + '/events.bin', data
+
+
+def test_ranged_download(tmp_path, http_server, small_segments):
+    url, data = write_served_file(http_server, 256 * 40)
+    path = str(tmp_path / 'events.bin')
+    download = downloads.RangedDownload(url, path, len(data)).start()
+    with download.open_reader() as reader:
+        assert reader.read() == data
+    download.wait()
+    assert open(path, 'rb').read() == data
+    assert not os.path.exists(path + '.part') and not os.path.exists(path + '.part.json')
+
+
+def test_failed_ranged_download_stops_writing(tmp_path, http_server, small_segments):
+    url, data = write_served_file(http_server, 256 * 40)
+    http_server.fail_from = 3000
+    path = str(tmp_path / 'events.bin')
+    download = downloads.RangedDownload(url, path, len(data)).start()
+    with pytest.raises(IOError):
+        download.wait()
+    # no segment is running after the error, so the part file is not written anymore
+    assert all(future.done() for future in download.futures)
+    assert not os.path.exists(path)
+
+    # completed segments are kept and the download is resumed from them
+    http_server.fail_from = float('inf')
+    resumed = downloads.RangedDownload(url, path, len(data))
+    resumed.load_state()
+    assert 0 < len(resumed.completed) < len(resumed.segments)
+    resumed.start().wait()
+    assert open(path, 'rb').read() == data
+
+
+def make_partial_download(local_cache, url):
+    entry_path = cache.get_cache_entry_path(url)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    with open(entry_path + '.part', 'wb') as part_file:
+        part_file.truncate(5000)
+    with open(entry_path + '.part.json', 'w') as state_file:
+        state_file.write('{}')
+    return entry_path
+
+
+def test_eviction_of_interrupted_download(local_cache):
+    entry_path = make_partial_download(local_cache, 'http://127.0.0.1/interrupted.csv.gz')
+    cache.evict(size_limit=1000)
+    assert not os.path.exists(entry_path + '.part') and not os.path.exists(entry_path + '.part.json')
+
+
+def test_running_download_is_not_evicted(local_cache):
+    entry_path = make_partial_download(local_cache, 'http://127.0.0.1/running.csv.gz')
+    lock_file = cache.acquire_lock(entry_path + '.lock')
+    try:
+        cache.evict(size_limit=1000)
+        assert os.path.exists(entry_path + '.part')
+    finally:
+        cache.release_lock(lock_file)
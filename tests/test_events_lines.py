@@ -0,0 +1,49 @@
+import gzip
+
+import pytest
+
+from tools.events import find_lines, get_event_types_pattern, read_events_chunks_of_types, \
+    read_filtered_events_chunks_parallel
+
+
+def write_events(path, header, rows):
+    with gzip.open(path, 'wt') as events_file:
+        events_file.write(header + '\n')
+        for row in rows:
+            events_file.write(row + '\n')
+    return str(path)
+
+
+# 'type' is the first column, matching rows 1, 2 and 4, 5 are adjacent
+type_first_rows = [
+    'ModeChoice,10.0,p0,',
+    'PathTraversal,11.0,,v1',
+    'PathTraversal,12.0,,v2',
+    'ModeChoice,13.0,p3,',
+    'PathTraversal,14.0,,v4',
+    'PathTraversal,15.0,,v5',
+]
+
+
+@pytest.mark.parametrize('header, block, expected', [
+    ('type,time', b'A,1\nB,2\nB,3\nA,4\nB,5\nB,6', [b'B,2', b'B,3', b'B,5', b'B,6']),
+    ('type,time', b'B,1\nB,2\n', [b'B,1', b'B,2']),
+    ('time,type', b'1,A\n2,B\n3,B\n4,A\n5,B', [b'2,B', b'3,B', b'5,B']),
+    ('time,type,x', b'1,A,a\n2,B,b\n3,B,c', [b'2,B,b', b'3,B,c']),
+])
+def test_find_lines_of_adjacent_rows(header, block, expected):
+    pattern = get_event_types_pattern(header.encode('utf-8'), ['B'])
+    assert find_lines(pattern, block) == expected
+
+
+def test_type_first_column_adjacent_rows(tmp_path):
+    events_path = write_events(tmp_path / 'events.csv.gz', 'type,time,person,vehicle', type_first_rows)
+    df = next(read_events_chunks_of_types(events_path, ['PathTraversal']))
+    assert list(df['vehicle']) == ['v1', 'v2', 'v4', 'v5']
+
+
+def test_type_first_column_adjacent_rows_parallel(tmp_path):
+    events_path = write_events(tmp_path / 'events.csv.gz', 'type,time,person,vehicle', type_first_rows)
+    chunks = read_filtered_events_chunks_parallel(events_path, lambda df: df['type'] == 'PathTraversal', processes=2,
+                                                  event_types=['PathTraversal'], block_size=40)
+    assert [vehicle for df in chunks for vehicle in df['vehicle']] == ['v1', 'v2', 'v4', 'v5']
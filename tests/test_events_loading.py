@@ -0,0 +1,174 @@
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools import events
+from tools.events import (EventsScanner, IdDictionary, SpilledEvents, build_events_gzip_index, build_events_manifest,
+                          concat_events, convert_events_to_parquet, get_events_dataset_path, get_events_schema,
+                          load_events, read_filtered_events_chunks_parallel)
+
+rows = [
+    'ModeChoice,3600.0,p1,,car',
+    'PathTraversal,3700.0,,v1,car',
+    'ModeChoice,7200.0,p2,,walk',
+    'PathTraversal,7300.0,,v2,walk',
+    'PathTraversal,10900.0,,v3,car',
+]
+
+
+@pytest.fixture
+def events_path(tmp_path):
+    path = str(tmp_path / '0.events.csv.gz')
+    with gzip.open(path, 'wt') as events_file:
+        events_file.write('type,time,person,vehicle,mode\n')
+        for row in rows:
+            events_file.write(row + '\n')
+    return path
+
+
+def is_path_traversal(df):
+    return df['type'] == 'PathTraversal'
+
+
+@pytest.mark.parametrize('event_types, processes', [(None, None), (['PathTraversal'], None), (['PathTraversal'], 2)])
+@pytest.mark.parametrize('with_manifest', [False, True])
+def test_time_range(events_path, event_types, processes, with_manifest):
+    if with_manifest:
+        build_events_manifest(events_path)
+    df = load_events(events_path, is_path_traversal, event_types=event_types, processes=processes,
+                     time_range=(7000, 11000))
+    assert list(df['vehicle']) == ['v2', 'v3']
+    assert list(df['hour']) == [2, 3]
+
+
+@pytest.mark.parametrize('event_types, processes', [(None, None), (['PathTraversal'], None), (['PathTraversal'], 2)])
+@pytest.mark.parametrize('time_range', [(0, 1000), (20000, 30000)])
+@pytest.mark.parametrize('memory_limit', [None, 10 ** 9])
+def test_time_range_without_events(events_path, event_types, processes, time_range, memory_limit):
+    df = load_events(events_path, is_path_traversal, event_types=event_types, processes=processes,
+                     time_range=time_range, memory_limit=memory_limit)
+    assert len(df) == 0
+    assert {'type', 'time', 'person', 'vehicle', 'mode', 'hour'} <= set(df.columns)
+
+
+def test_concat_no_events():
+    assert len(concat_events([])) == 0
+
+
+def test_scanner_consumers(events_path):
+    scanner = EventsScanner(events_path, chunksize=2)
+    scanner.add_consumer('modechoice', lambda df: df['type'] == 'ModeChoice', columns=['person', 'mode'])
+    scanner.add_consumer('car_events', lambda df: df['mode'] == 'car', reducer=lambda count, df: count + len(df),
+                         initial=0)
+    results = scanner.scan()
+    assert results['modechoice'].to_dict('list') == {'person': ['p1', 'p2'], 'mode': ['car', 'walk']}
+    assert results['car_events'] == 3
+
+    with pytest.raises(ValueError):
+        scanner.add_consumer('modechoice', lambda df: df['type'] == 'ModeChoice')
+
+
+def test_parquet_dataset(events_path):
+    pytest.importorskip('pyarrow')
+    from_csv = load_events(events_path, is_path_traversal, event_types=['PathTraversal'])
+    convert_events_to_parquet(events_path)
+    assert get_events_dataset_path(events_path).endswith('0.events.parquet')
+
+    from_parquet = load_events(events_path, is_path_traversal, event_types=['PathTraversal'])
+    assert list(from_parquet['vehicle']) == list(from_csv['vehicle']) == ['v1', 'v2', 'v3']
+    assert list(from_parquet['time']) == list(from_csv['time'])
+
+
+def test_events_schema(events_path):
+    schema = get_events_schema(events_path, ['PathTraversal'])
+    assert schema['time'] == 'int32' and schema['type'] == 'category' and schema['mode'] == 'category'
+    assert schema['vehicle'] == str
+
+    df = load_events(events_path, is_path_traversal, event_types=['PathTraversal'])
+    assert isinstance(df['mode'].dtype, pd.CategoricalDtype)
+    assert df['time'].dtype == 'int32'
+
+
+@pytest.mark.parametrize('event_types, processes', [(None, None), (['PathTraversal'], None), (['PathTraversal'], 2)])
+def test_column_projection(events_path, event_types, processes):
+    assert set(get_events_schema(events_path, columns=['vehicle'])) == {'time', 'type', 'vehicle'}
+    df = load_events(events_path, is_path_traversal, event_types=event_types, processes=processes,
+                     columns=['vehicle'])
+    assert set(df.columns) == {'time', 'type', 'vehicle', 'hour'}
+    assert list(df['vehicle']) == ['v1', 'v2', 'v3']
+
+
+def test_spill_over_memory_limit(events_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(events, 'events_spill_dir', str(tmp_path))
+    spilled = load_events(events_path, is_path_traversal, chunksize=2, memory_limit=1)
+    assert isinstance(spilled, SpilledEvents)
+    assert len(spilled) == 3 and os.path.isdir(spilled.path) and spilled.path.startswith(str(tmp_path))
+
+    df = load_events(events_path, is_path_traversal, chunksize=2)
+    pd.testing.assert_frame_equal(spilled.to_pandas(), df.reset_index(drop=True))
+    assert spilled.to_pandas(columns=['vehicle'])['vehicle'].tolist() == ['v1', 'v2', 'v3']
+    car = spilled.query(lambda chunk: chunk['mode'] == 'car', columns=['vehicle', 'mode'])
+    assert car['vehicle'].tolist() == ['v1', 'v3']
+    assert sum(len(chunk) for chunk in spilled) == 3
+
+    spilled.close()
+    assert not os.path.exists(spilled.path)
+
+
+def test_memory_limit_not_reached(events_path):
+    df = load_events(events_path, is_path_traversal, chunksize=2, memory_limit=10 ** 9)
+    assert isinstance(df, pd.DataFrame) and df['vehicle'].tolist() == ['v1', 'v2', 'v3']
+
+
+def test_id_dictionary():
+    ids = IdDictionary()
+    codes = ids.encode(pd.Series(['b', 'a', None, 'b']))
+    assert codes.dtype == np.int32 and list(codes) == [0, 1, -1, 0]
+    # codes of known ids are kept, new ids are appended
+    assert list(ids.encode(pd.Series(['c', 'a']))) == [2, 1]
+    assert len(ids) == 3 and ids.get_code('c') == 2 and ids.get_code('d') == -1
+    assert list(ids.decode([1, -1, 2])) == ['a', None, 'c']
+
+
+def test_load_events_with_id_dictionary(events_path):
+    ids = IdDictionary()
+    df = load_events(events_path, lambda chunk: chunk['type'].notna(), chunksize=2, id_dictionary=ids)
+    assert df['person'].dtype == np.int32 and df['vehicle'].dtype == np.int32
+    # persons and vehicles share one dictionary
+    assert list(df['person']) == [0, -1, 2, -1, -1]
+    assert list(ids.decode(df['vehicle'])) == [None, 'v1', None, 'v2', 'v3']
+
+
+@pytest.fixture
+def sparse_events_path(tmp_path):
+    # 'reason' of Replanning is the only value of the categorical column, it is in the last chunk
+    path = str(tmp_path / 'sparse.events.csv.gz')
+    with gzip.open(path, 'wt') as events_file:
+        events_file.write('type,time,person,mode,reason\n')
+        for idx in range(10):
+            events_file.write('ModeChoice,{},p{},car,\n'.format(idx, idx))
+        events_file.write('Replanning,20,p1,,too long\n')
+    return path
+
+
+@pytest.mark.parametrize('event_filter', [lambda df: df['type'] == 'ModeChoice', lambda df: df['type'].notna()])
+def test_sparse_categorical_column(sparse_events_path, event_filter):
+    df = load_events(sparse_events_path, event_filter, chunksize=4)
+    assert len(df) == len(event_filter(df)) and isinstance(df['reason'].dtype, pd.CategoricalDtype)
+    assert df['mode'].iloc[:10].tolist() == ['car'] * 10
+
+    scanner = EventsScanner(sparse_events_path, chunksize=4)
+    scanner.add_consumer('events', event_filter, columns=['person', 'reason'])
+    assert scanner.scan()['events']['reason'].tolist() == df['reason'].tolist()
+
+
+def test_sparse_categorical_column_parallel(sparse_events_path):
+    pytest.importorskip('indexed_gzip')
+    build_events_gzip_index(sparse_events_path)
+    chunks = read_filtered_events_chunks_parallel(sparse_events_path, lambda df: df['type'].notna(), 2,
+                                                  block_size=64)
+    df = concat_events(chunks)
+    assert len(df) == 11 and df['reason'].tolist()[-1] == 'too long'
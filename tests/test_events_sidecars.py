@@ -0,0 +1,134 @@
+import gzip
+import os
+
+import pytest
+
+from tools.events import build_events_gzip_index, build_events_manifest, convert_events_to_parquet, \
+    get_events_dataset_path, get_path_traversal_links, is_events_dataset_present, is_events_gzip_index_present, \
+    load_events, load_events_manifest, open_events_file, read_filtered_events_chunks_parallel
+
+header = 'type,time,vehicle,links,linkTravelTime\n'
+
+
+def write_events(path, rows, mtime):
+    with gzip.open(path, 'wt') as events_file:
+        events_file.write(header)
+        for row in rows:
+            events_file.write(row + '\n')
+    os.utime(path, (mtime, mtime))
+
+
+def test_manifest_of_changed_local_file(tmp_path):
+    events_path = str(tmp_path / '0.events.csv.gz')
+    write_events(events_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'], 1000000)
+    assert build_events_manifest(events_path)['rows'] == 1
+    assert load_events_manifest(events_path)['rows'] == 1
+
+    write_events(events_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'] * 2, 2000000)
+    assert load_events_manifest(events_path) is None
+
+
+def test_gzip_index_of_changed_local_file(tmp_path):
+    pytest.importorskip('indexed_gzip')
+    events_path = str(tmp_path / '0.events.csv.gz')
+    write_events(events_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'], 1000000)
+    build_events_gzip_index(events_path)
+    assert is_events_gzip_index_present(events_path)
+
+    write_events(events_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'] * 2, 2000000)
+    assert not is_events_gzip_index_present(events_path)
+
+
+def test_links_of_changed_local_file(tmp_path):
+    events_path = str(tmp_path / '0.events.csv.gz')
+    write_events(events_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'], 1000000)
+    assert list(get_path_traversal_links(events_path).links) == [1, 2]
+
+    write_events(events_path, ['PathTraversal,10.0,v1,"3,4,5","1.0,2.0,3.0"'], 2000000)
+    assert list(get_path_traversal_links(events_path).links) == [3, 4, 5]
+
+
+def test_dataset_of_changed_local_file(tmp_path):
+    pytest.importorskip('pyarrow')
+    events_path = str(tmp_path / '0.events.csv.gz')
+    write_events(events_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'], 1000000)
+    dataset_path = convert_events_to_parquet(events_path)
+    assert is_events_dataset_present(dataset_path, events_path)
+
+    write_events(events_path, ['PathTraversal,10.0,v2,"1,2","1.0,2.0"'], 2000000)
+    assert not is_events_dataset_present(get_events_dataset_path(events_path), events_path)
+    df = load_events(events_path, lambda chunk: chunk['type'] == 'PathTraversal', event_types=['PathTraversal'])
+    assert list(df['vehicle']) == ['v2']
+
+
+def test_sidecars_of_revalidated_remote_file(local_cache, http_dir):
+    directory, url = http_dir
+    served_path = str(directory / '0.events.csv.gz')
+    events_url = url + '/0.events.csv.gz'
+
+    write_events(served_path, ['PathTraversal,10.0,v1,"1,2","1.0,2.0"'], 1000000)
+    assert build_events_manifest(events_url)['rows'] == 1
+    assert list(get_path_traversal_links(events_url).links) == [1, 2]
+    assert load_events_manifest(events_url)['rows'] == 1
+
+    # the cache gets the new file with a new Last-Modified, sidecars of the old file are not used
+    write_events(served_path, ['PathTraversal,10.0,v1,"3,4,5","1.0,2.0,3.0"'] * 2, 2000000)
+    assert load_events_manifest(events_url) is None
+    assert list(get_path_traversal_links(events_url).links) == [3, 4, 5, 3, 4, 5]
+    assert build_events_manifest(events_url)['rows'] == 2
+    assert load_events_manifest(events_url)['rows'] == 2
+
+
+timed_rows = ['PathTraversal,10.0,v1,"1,2","1.0,2.0"', 'ModeChoice,3700.0,,,', 'PathTraversal,3650.0,v2,3,1.0',
+              'PathTraversal,7300.0,v3,4,1.0']
+
+
+@pytest.mark.parametrize('block_size', [16, 64 * 1024 * 1024])
+def test_manifest_stats(tmp_path, block_size):
+    events_path = str(tmp_path / '0.events.csv.gz')
+    write_events(events_path, timed_rows, 1000000)
+    manifest = build_events_manifest(events_path, block_size)
+    content = (header + '\n'.join(timed_rows) + '\n').encode()
+    assert manifest['rows'] == 4 and manifest['size'] == len(content)
+
+    path_traversal = manifest['types']['PathTraversal']
+    assert path_traversal['count'] == 3 and path_traversal['min_time'] == 10.0 and path_traversal['max_time'] == 7300.0
+    assert path_traversal['first_offset'] == len(header)
+    assert path_traversal['last_offset'] == content.index(b'PathTraversal,7300')
+
+    # ModeChoice at 3700 is the first row of the hour 1, later PathTraversal at 3650 does not change that
+    assert [hour['row'] for hour in manifest['hours']] == [0, 1, 3]
+    assert manifest['hours'][1]['offset'] == content.index(b'ModeChoice')
+    assert load_events_manifest(events_path) == manifest
+
+
+@pytest.mark.parametrize('with_index', [False, True])
+def test_open_events_file_at_offset(tmp_path, with_index):
+    events_path = str(tmp_path / '0.events.csv.gz')
+    write_events(events_path, timed_rows, 1000000)
+    if with_index:
+        pytest.importorskip('indexed_gzip')
+        build_events_gzip_index(events_path)
+    assert is_events_gzip_index_present(events_path) == with_index
+
+    offset = build_events_manifest(events_path)['hours'][2]['offset']
+    with open_events_file(events_path, offset) as stream:
+        assert stream.read() == b'PathTraversal,7300.0,v3,4,1.0\n'
+
+
+def test_parallel_parsing_of_remote_file(local_cache, http_server):
+    pytest.importorskip('indexed_gzip')
+    events_url = http_server.url + '/0.events.csv.gz'
+    write_events(str(http_server.directory / '0.events.csv.gz'),
+                 ['PathTraversal,{}.0,v{},{},1.0'.format(idx, idx, idx) for idx in range(100)], 1000000)
+    build_events_gzip_index(events_url)
+
+    requests = []
+    for block_size in [256, 64 * 1024 * 1024]:
+        del http_server.requests[:]
+        chunks = read_filtered_events_chunks_parallel(events_url, lambda df: df['type'] == 'PathTraversal', 2,
+                                                      block_size=block_size)
+        assert sum(len(df) for df in chunks) == 100
+        requests.append(len(http_server.requests))
+    # the cached copy is revalidated by the parent process only, not for every range in the workers
+    assert requests[0] == requests[1]
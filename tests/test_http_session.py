@@ -0,0 +1,18 @@
+from urllib.error import HTTPError
+
+import pytest
+
+from tools import http_session
+
+
+def test_get(http_server):
+    (http_server.directory / 'stats.csv').write_bytes(b'link,volume\n1,2\n')
+    response = http_session.get(http_server.url + '/stats.csv', headers={'Range': 'bytes=5-15'})
+    assert response.status_code == 206 and response.content == b'volume\n1,2\n'
+    assert http_session.head(http_server.url + '/stats.csv').headers['Content-Length'] == '16'
+
+
+def test_missing_file(http_server):
+    with pytest.raises(HTTPError) as error:
+        http_session.get(http_server.url + '/missing.csv')
+    assert error.value.code == 404
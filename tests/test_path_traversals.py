@@ -0,0 +1,177 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+
+from tools.events import (PathTraversalLinks, calc_link_travel_times_by_hour, calc_link_volumes_by_hour,
+                          calc_person_transit_distances, count_transit_trips, find_link_group_crossings,
+                          get_link_entry_times, load_path_traversals, parse_number_lists)
+
+
+def make_links(links, travel_times):
+    """
+    PathTraversalLinks from lists of links and travel times of every event
+    """
+    offsets = np.concatenate([[0], np.cumsum([len(event_links) for event_links in links])]).astype(np.int64)
+    return PathTraversalLinks(np.array([link for event_links in links for link in event_links], dtype=np.int32),
+                              np.array([tt for event_tts in travel_times for tt in event_tts], dtype=np.float32),
+                              offsets)
+
+
+def test_parse_number_lists():
+    numbers, offsets = parse_number_lists(pd.Series(['1,2,3', None, '', '40', '5,6']), np.int32)
+    assert list(numbers) == [1, 2, 3, 40, 5, 6]
+    assert list(offsets) == [0, 3, 3, 3, 4, 6]
+    assert numbers.dtype == np.int32
+
+    numbers, offsets = parse_number_lists(pd.Series(['1.5,2', '0.25']), np.float32)
+    assert list(numbers) == [1.5, 2.0, 0.25]
+    assert list(offsets) == [0, 2, 3]
+
+
+def test_take_and_slice():
+    csr = make_links([[1, 2], [], [3], [4, 5, 6]], [[1, 2], [], [3], [4, 5, 6]])
+    taken = csr.take(np.array([False, True, True, True]))
+    assert list(taken.links) == [3, 4, 5, 6] and list(taken.offsets) == [0, 0, 1, 4]
+    taken = csr.take([3, 0])
+    assert list(taken.links) == [4, 5, 6, 1, 2] and list(taken.offsets) == [0, 3, 5]
+
+    sliced = csr.slice(1, 4)
+    assert list(sliced.links) == [3, 4, 5, 6] and list(sliced.offsets) == [0, 0, 1, 4]
+    assert list(csr.get_event_indices()) == [0, 0, 2, 3, 3, 3]
+
+    blocks = csr.get_blocks(2)
+    assert blocks[0][0] == 0 and blocks[-1][1] == len(csr)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(blocks, blocks[1:]))
+
+
+def test_load_path_traversals(tmp_path):
+    events_path = str(tmp_path / '0.events.csv.gz')
+    with gzip.open(events_path, 'wt') as events_file:
+        events_file.write('type,time,vehicle,departureTime,links,linkTravelTime\n')
+        events_file.write('PathTraversal,10.0,v1,0,"1,2","1.0,2.0"\n')
+        events_file.write('ModeChoice,11.0,,,,\n')
+        events_file.write('PathTraversal,12.0,v2,5,,\n')
+        events_file.write('PathTraversal,13.0,v3,6,"3","4.5"\n')
+
+    df, csr = load_path_traversals(events_path, ['vehicle', 'departureTime'])
+    assert list(df['vehicle']) == ['v1', 'v2', 'v3']
+    assert list(csr.links) == [1, 2, 3] and list(csr.offsets) == [0, 2, 2, 3]
+    assert list(csr.travel_times) == [1.0, 2.0, 4.5]
+
+
+def test_link_entry_times_with_unknown_travel_time():
+    # the travel time of the second link of the first event is unknown
+    csr = make_links([[1, 2, 3], [4, 5]], [[100, np.nan, 100], [200, 300]])
+    df = pd.DataFrame({'departureTime': [0, 3500]})
+    entry_times = get_link_entry_times(df, csr)
+    assert list(entry_times[:2]) == [0, 100]
+    assert np.isnan(entry_times[2])
+    # later events are not affected
+    assert list(entry_times[3:]) == [3500, 3700]
+
+
+def test_link_volumes_by_hour():
+    csr = make_links([[1, 2, 3], [1, 2], [1], [2]], [[100, np.nan, 100], [3000, 600], [10], [10]])
+    df = pd.DataFrame({'departureTime': [0, 1000, 7300, 3600], 'mode': ['car', 'car', 'walk', 'bus'],
+                       'numPassengers': [1, 0, 0, 5], 'vehicleType': ['Car', 'Car', 'BODY', 'BUS']})
+    volumes = calc_link_volumes_by_hour(df, csr, block_size=2)
+    # the hour of entering link 3 is unknown, because it is after the link with unknown travel time
+    assert volumes.to_dict('list') == {'link': [1, 1, 2, 2], 'hour': [0, 2, 0, 1], 'volume': [2, 1, 1, 2],
+                                       'persons': [3.0, 1.0, 2.0, 6.0]}
+
+    by_type = calc_link_volumes_by_hour(df, csr, by='vehicleType').set_index(['vehicleType', 'link', 'hour'])
+    assert by_type.loc[('Car', 2, 1), 'volume'] == 1 and by_type.loc[('BUS', 2, 1), 'persons'] == 5.0
+    assert by_type['volume'].sum() == 6
+
+
+def test_link_volumes_of_big_link_ids():
+    # arrays of the size of the network would not fit into memory
+    csr = make_links([[2000000000, 5], [2000000000], [5]], [[10, 10], [10], [10]])
+    df = pd.DataFrame({'departureTime': [0, 7200, 3600], 'mode': ['car', 'bus', 'car'], 'numPassengers': [0, 3, 0],
+                       'vehicleType': ['Car', 'BUS', None]})
+    volumes = calc_link_volumes_by_hour(df, csr, by='vehicleType', block_size=1)
+    # events without vehicle type are not counted
+    assert volumes.to_dict('list') == {'vehicleType': ['Car', 'Car', 'BUS'], 'link': [5, 2000000000, 2000000000],
+                                       'hour': [0, 0, 2], 'volume': [1, 1, 1], 'persons': [1.0, 1.0, 3.0]}
+
+
+def test_link_travel_times_by_hour():
+    csr = make_links([[1, 2], [1, 2], [1], [1, 2]], [[10, 20], [30, 40], [50], [np.nan, 60]])
+    df = pd.DataFrame({'departureTime': [0, 100, 200, 3600]})
+    travel_times = calc_link_travel_times_by_hour(df, csr, percentiles=(50, 90))
+    # travel time of link 1 of the last event is unknown, and so is the hour of entering link 2 after it
+    assert travel_times[['link', 'hour', 'count']].values.tolist() == [[1, 0, 3], [2, 0, 2]]
+    link_1 = travel_times.iloc[0]
+    assert link_1['mean'] == 30.0
+    assert link_1['p50'] == np.percentile([10, 30, 50], 50) and link_1['p90'] == np.percentile([10, 30, 50], 90)
+
+    assert list(calc_link_travel_times_by_hour(df, csr, links=[2], percentiles=())['link']) == [2]
+
+
+def test_mismatched_travel_times():
+    df = pd.DataFrame({'links': ['1,2', '3,4,5', '6'], 'linkTravelTime': ['1.0,2.0', '3.0', '6.0']})
+    csr = PathTraversalLinks.from_events(df)
+    assert list(csr.links) == [1, 2, 3, 4, 5, 6]
+    assert list(csr.travel_times[:2]) == [1.0, 2.0] and csr.travel_times[5] == 6.0
+    assert np.isnan(csr.travel_times[2:5]).all()
+
+
+def test_link_group_crossings():
+    df = pd.DataFrame({'departureTime': [0, 3500, 7200],
+                       'links': ['1,10,11,2', '3,10', '4,20'],
+                       'linkTravelTime': ['100,10,10,1', '200', '1,1']})
+    csr = PathTraversalLinks.from_events(df)
+    crossings = find_link_group_crossings(df, csr, {'bridge': {10, 11}, 'tunnel': {20}, 'unused': set()})
+    # one crossing of the bridge by the first event however many links of it there are
+    assert crossings['event'].tolist() == [0, 1, 2]
+    assert crossings['group'].tolist() == ['bridge', 'bridge', 'tunnel']
+    assert crossings['hour'].dtype == 'Int64'
+    # travel times of the second event do not match its links, so the hour is unknown
+    assert crossings['hour'].tolist()[0] == 0 and pd.isna(crossings['hour'][1]) and crossings['hour'][2] == 2
+
+    by_hour = crossings.groupby(['hour', 'group'], observed=False, dropna=False).size().unstack('group', fill_value=0)
+    assert by_hour['bridge'].sum() == 2 and by_hour['unused'].sum() == 0
+    assert by_hour.index.isna().sum() == 1
+
+
+def test_count_transit_trips():
+    pev = pd.DataFrame({'person': ['p1', 'p2', 'p1', 'p1', 'p2', 'p1', 'p3'],
+                        'vehicleType': ['SUBWAY', 'BUS', 'SUBWAY', 'BUS', 'BUS', 'SUBWAY', None]})
+    trips = count_transit_trips(pev)
+    assert trips.index.name == 'vehicleType'
+    # p1: subway with a transfer, bus, subway; p2: bus with a transfer
+    assert trips.to_dict('index') == {'SUBWAY': {'unlinked_trips': 3, 'linked_trips': 2},
+                                      'BUS': {'unlinked_trips': 3, 'linked_trips': 2}}
+
+    trips = count_transit_trips(pev, vehicle_types=['BUS', 'FERRY'])
+    assert trips.index.tolist() == ['BUS', 'FERRY'] and trips.index.name == 'vehicleType'
+    assert trips.loc['FERRY'].tolist() == [0, 0]
+
+    empty = count_transit_trips(pev.iloc[:0])
+    assert len(empty) == 0 and list(empty.columns) == ['unlinked_trips', 'linked_trips']
+
+
+def test_person_transit_distances():
+    pte = pd.DataFrame({'vehicle': ['bus1', 'subway1', 'bus1', 'bus1'],
+                        'departureTime': [0, 150, 100, 200], 'arrivalTime': [100, 250, 200, 300],
+                        'length': [10.0, 100.0, 20.0, 30.0],
+                        'vehicleType': ['BUS-DEFAULT', 'SUBWAY-DEFAULT', 'BUS-DEFAULT', 'BUS-DEFAULT']})
+    pelv = pd.DataFrame([
+        ('PersonEntersVehicle', 'p2', 0, 'bus1'),
+        ('PersonEntersVehicle', 'p3', 0, 'bus1'),
+        ('PersonEntersVehicle', 'p4', 50, 'bus1'),
+        ('PersonLeavesVehicle', 'p5', 60, 'bus1'),
+        ('PersonEntersVehicle', 'p1', 100, 'bus1'),
+        ('PersonLeavesVehicle', 'p2', 100, 'bus1'),
+        ('PersonEntersVehicle', 'p2', 150, 'subway1'),
+        ('PersonLeavesVehicle', 'p2', 250, 'subway1'),
+        ('PersonLeavesVehicle', 'p1', 300, 'bus1'),
+        ('PersonLeavesVehicle', 'p4', 300, 'bus1'),
+    ], columns=['type', 'person', 'time', 'vehicle'])
+    distances = calc_person_transit_distances(pte, pelv, ['BUS-DEFAULT', 'SUBWAY-DEFAULT', 'RAIL-DEFAULT'])
+    # p3 did not leave the bus, p4 entered it when it did not depart, p5 left without entering
+    assert distances.index.name == 'person' and list(distances.index) == ['p1', 'p2']
+    # p1 rode the last two traversals of the bus, p2 the first one and then the subway
+    assert distances.to_dict('list') == {'BUS-DEFAULT': [50.0, 10.0], 'SUBWAY-DEFAULT': [0.0, 100.0],
+                                         'RAIL-DEFAULT': [0.0, 0.0]}
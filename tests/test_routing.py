@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import routing
+from tools.routing import get_person_request, get_persons_requests, get_vehicle_ids, load_routing_requests, \
+    tokenize_vehicle_ids
+
+requests_csv = '''requestId,originUTM_X,originUTM_Y,departureTime,streetVehicle_0_id,streetVehicle_0_mode,streetVehicle_1_id,streetVehicle_2_id
+0,636961.5,273599.5,8038,rideHailVehicle-45,car,body-12,
+1,269786.5,254411.5,37329,dummySharedCar,car,12,
+2,40973.5,749642.5,12854,body-7,walk,rideHailVehicle-30,
+3,16527.5,866046.5,52847,body-120,walk,,
+4,16527.5,866046.5,100,body-12,walk,12,
+'''
+
+
+@pytest.fixture
+def requests_path(tmp_path):
+    path = tmp_path / 'routingRequest.csv'
+    path.write_text(requests_csv)
+    return str(path)
+
+
+def test_tokenize_vehicle_ids():
+    kind, number = tokenize_vehicle_ids(pd.Series(['body-12', 'rideHailVehicle-0', '7', 'dummySharedCar', None,
+                                                   'car-007']))
+    assert list(kind.astype(object)[:4]) == ['body', 'rideHailVehicle', '', 'dummySharedCar']
+    assert pd.isna(kind[4])
+    assert list(number) == [12, 0, 7, -1, -1, -1]
+    assert number.dtype == np.int32
+
+
+def test_tokenize_all_missing_vehicle_ids():
+    kind, number = tokenize_vehicle_ids(pd.Series([np.nan, np.nan, np.nan]))
+    assert kind.isna().all() and len(kind) == 3
+    assert list(number) == [-1, -1, -1]
+
+
+def test_load_routing_requests(requests_path):
+    req_df = load_routing_requests(requests_path)
+    assert req_df['departureTime'].dtype == np.int32
+    assert req_df['originUTM_X'].dtype == np.float32
+    assert 'streetVehicle_0_id' not in req_df.columns
+    # the slot which is never used
+    assert req_df['streetVehicle_2_kind'].isna().all()
+    assert list(req_df['streetVehicle_2_number']) == [-1] * 5
+
+    original = pd.read_csv(requests_path, dtype=str)
+    for vehicle_idx in range(3):
+        vehicle_ids = get_vehicle_ids(req_df, vehicle_idx)
+        expected = original['streetVehicle_{}_id'.format(vehicle_idx)]
+        assert list(vehicle_ids.fillna('')) == list(expected.fillna(''))
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_person_requests(requests_path, typed):
+    req_df = load_routing_requests(requests_path) if typed else pd.read_csv(requests_path, low_memory=False)
+    # exact ids only, 'body-120' is not a request of person 12
+    assert list(get_person_request(req_df, '12')['requestId']) == [4, 0, 1]
+    assert list(get_person_request(req_df, 12)['requestId']) == [4, 0, 1]
+    assert len(get_person_request(req_df, 'unknown')) == 0
+
+    persons_requests = get_persons_requests(req_df, ['7', '12', '120'])
+    assert list(persons_requests['requestId']) == [4, 0, 2, 1, 3]
+    assert list(persons_requests['person'].astype(str)) == ['12', '12', '7', '12', '120']
+
+
+irregular_requests_csv = '''requestId,departureTime,streetVehicle_0_id,streetVehicle_1_id
+0,300,body-0123,
+1,200,0123,123
+2,100,body-2012000065238-0,rideHailVehicle-45
+3,400,2012000065238-0,body-2012000065238
+'''
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_irregular_person_ids(tmp_path, typed):
+    path = tmp_path / 'routingRequest.csv'
+    path.write_text(irregular_requests_csv)
+    req_df = load_routing_requests(str(path)) if typed else pd.read_csv(path, dtype=str)
+    # ids which are not canonical integers are matched as strings
+    assert list(get_person_request(req_df, '0123')['requestId'].astype(int)) == [1, 0]
+    assert list(get_person_request(req_df, '123')['requestId'].astype(int)) == [1]
+    assert list(get_person_request(req_df, '2012000065238-0')['requestId'].astype(int)) == [2, 3]
+    assert list(get_person_request(req_df, '2012000065238')['requestId'].astype(int)) == [3]
+    assert list(get_person_request(req_df, 'rideHailVehicle-45')['requestId'].astype(int)) == [2]
+
+    persons_requests = get_persons_requests(req_df, ['0123', '123', '2012000065238-0'])
+    assert list(persons_requests['requestId'].astype(int)) == [2, 1, 1, 0, 3]
+    assert list(persons_requests['person'].astype(str)) == ['2012000065238-0', '0123', '123', '0123',
+                                                           '2012000065238-0']
+
+
+def test_routing_module_uses_the_same_index(requests_path):
+    req_df = load_routing_requests(requests_path)
+    assert list(routing.get_person_request(req_df, '12')['requestId']) == [4, 0, 1]
+    assert list(routing.get_persons_requests(req_df, ['7'])['requestId']) == [2]
@@ -0,0 +1,133 @@
+"""
+group-by aggregation over a stream of chunks (events, linkstats).
+only partial aggregates per group are kept between chunks, so memory depends on the number of groups
+and not on the number of rows.
+
+volume_by_hour = aggregate_chunks(pd.read_csv(linkstats_path, chunksize=100000), 'hour', {'sum': ('volume', 'sum')})
+"""
+import pandas as pd
+
+# aggregations of chunk and how partial states of them are merged
+partial_aggregations = {
+    'sum': 'sum',
+    'count': 'sum',
+    'min': 'min',
+    'max': 'max',
+    'first': 'first',
+}
+
+
+def concat_lists(lists):
+    return [value for values in lists for value in values]
+
+
+class StreamingGroupBy:
+    def __init__(self, by, aggregations, sort=True):
+        """
+        by - column or list of columns to group by
+        aggregations - {result column: (column, function)}, function is one of
+            'sum', 'count' (not null values), 'min', 'max', 'mean', 'first' (in order of chunks), 'list'
+        sort - sort result by group keys
+        """
+        self.by = by
+        self.aggregations = aggregations
+        self.sort = sort
+        self.state = None
+        # partial aggregates of chunks which are not merged into the state yet
+        self.pending = []
+        self.pending_rows = 0
+
+        for column, function in aggregations.values():
+            if function not in partial_aggregations and function not in ('mean', 'list'):
+                raise ValueError("unknown aggregation '{}' of column '{}'".format(function, column))
+
+    def get_partial_columns(self):
+        """
+        {partial state column: (column, chunk aggregation, merge aggregation)}
+        mean is kept as sum and count
+        """
+        partial_columns = {}
+        for name, (column, function) in self.aggregations.items():
+            if function == 'mean':
+                partial_columns[name + '_sum'] = (column, 'sum', 'sum')
+                partial_columns[name + '_count'] = (column, 'count', 'sum')
+            elif function == 'list':
+                partial_columns[name] = (column, list, concat_lists)
+            else:
+                partial_columns[name] = (column, function, partial_aggregations[function])
+        return partial_columns
+
+    def merge_state(self, partial):
+        """
+        partial aggregates are buffered and merged into the state only when there are at least as many
+        buffered rows as state rows, so every state row is regrouped a constant number of times on average
+        instead of once per chunk
+        """
+        self.pending.append(partial)
+        self.pending_rows = self.pending_rows + len(partial)
+        if self.state is None or self.pending_rows >= len(self.state):
+            self.flush()
+
+    def flush(self):
+        """
+        merge buffered partial aggregates into the state
+        """
+        if not self.pending:
+            return
+        partials = self.pending if self.state is None else [self.state] + self.pending
+        self.pending = []
+        self.pending_rows = 0
+        if len(partials) == 1:
+            self.state = partials[0]
+            return
+        merge = {name: merge_function for name, (_, _, merge_function) in self.get_partial_columns().items()}
+        levels = list(range(partials[0].index.nlevels))
+        self.state = pd.concat(partials).groupby(level=levels, sort=False).agg(merge)
+
+    def update(self, chunk):
+        """
+        add rows of chunk to the aggregates
+        """
+        if len(chunk) == 0:
+            return self
+        chunk_aggregations = {name: pd.NamedAgg(column=column, aggfunc=function)
+                              for name, (column, function, _) in self.get_partial_columns().items()}
+        self.merge_state(chunk.groupby(self.by, observed=True, sort=False).agg(**chunk_aggregations))
+        return self
+
+    def merge(self, other):
+        """
+        add aggregates of other StreamingGroupBy with the same parameters (i.e. computed in another process)
+        """
+        other.flush()
+        if other.state is not None:
+            self.merge_state(other.state)
+        return self
+
+    def result(self):
+        """
+        data frame with group keys as index and a column for each aggregation
+        """
+        self.flush()
+        if self.state is None:
+            return pd.DataFrame(columns=list(self.aggregations.keys()))
+
+        result = pd.DataFrame(index=self.state.index)
+        for name, (_, function) in self.aggregations.items():
+            if function == 'mean':
+                result[name] = self.state[name + '_sum'] / self.state[name + '_count']
+            else:
+                result[name] = self.state[name]
+        if self.sort:
+            result = result.sort_index()
+        return result
+
+
+def aggregate_chunks(chunks, by, aggregations, sort=True):
+    """
+    aggregate all chunks by StreamingGroupBy and return the result
+    """
+    group_by = StreamingGroupBy(by, aggregations, sort)
+    for chunk in chunks:
+        group_by.update(chunk)
+    return group_by.result()
@@ -0,0 +1,401 @@
+"""
+local on-disk cache of remote files (BEAM outputs, reference data).
+remote urls are keys of the cache, cached copies are read straight from local disk.
+
+local_path = cached_path(s3path + '/beamLog.out')
+"""
+import hashlib
+import json
+import os
+import requests
+import threading
+import time
+
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from . import http_session
+from .downloads import RangedDownload
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking on Windows
+    fcntl = None
+
+cache_dir = os.environ.get('BEAM_PYTHON_TOOLS_CACHE',
+                           os.path.join(os.path.expanduser("~"), ".beam_python_tools", "cache"))
+
+# the least recently used files are removed when the cache grows bigger than that (in bytes)
+cache_size_limit = int(os.environ.get('BEAM_PYTHON_TOOLS_CACHE_SIZE', 50 * 1024 * 1024 * 1024))
+
+# files bigger than that (in bytes) are downloaded by byte ranges in parallel, see downloads.RangedDownload
+ranged_download_min_size = 64 * 1024 * 1024
+
+service_suffixes = ('.lock', '.tmp', '.meta', '.part', '.part.json')
+# files of the cache itself in the root of cache_dir, cached copies are inside subdirectories
+service_files = ('immutable_prefixes.json', 'cache.lock')
+
+# downloads running in background threads of this process, by url, see open_cached
+active_downloads = {}
+active_downloads_lock = threading.Lock()
+
+
+def is_remote(path):
+    return urlparse(path).scheme in ('http', 'https')
+
+
+def get_cache_entry_path(url):
+    """
+    path of the cached copy of url. the file name of url is kept in order to keep its extension
+    (pandas decides on compression by it)
+    """
+    url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    file_name = os.path.basename(urlparse(url).path) or 'index'
+    return os.path.join(cache_dir, url_hash[:2], "{}-{}".format(url_hash, file_name))
+
+
+def acquire_lock(lock_path):
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_file = open(lock_path, 'a')
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    return lock_file
+
+
+def try_acquire_lock(lock_path):
+    """
+    lock file if the lock is acquired, None if it is held by someone else
+    (or there is no inter-process locking, so it is not known)
+    """
+    if fcntl is None:
+        return None
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def release_lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    lock_file.close()
+
+
+@contextmanager
+def file_lock(lock_path):
+    """
+    exclusive lock shared between processes, held while inside the `with` block
+    """
+    lock_file = acquire_lock(lock_path)
+    try:
+        yield
+    finally:
+        release_lock(lock_file)
+
+
+def download_to(url, path, headers=None):
+    """
+    download url into path atomically: other processes see either nothing or the whole file.
+    returns response headers or None if the server answered '304 Not Modified' to conditional request.
+    """
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with http_session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return None
+            with open(temp_path, 'wb') as temp_file:
+                for data in response.iter_content(1024 * 1024):
+                    temp_file.write(data)
+            os.replace(temp_path, path)
+            return response.headers
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_immutable_prefixes_path():
+    return os.path.join(cache_dir, 'immutable_prefixes.json')
+
+
+def get_immutable_prefixes():
+    prefixes_path = get_immutable_prefixes_path()
+    if not os.path.exists(prefixes_path):
+        return []
+    with open(prefixes_path) as prefixes_file:
+        return json.load(prefixes_file)
+
+
+def mark_immutable(url_prefix):
+    """
+    files with urls starting with url_prefix (i.e. output path of a finished run) never change,
+    so their cached copies are used without revalidation.
+    """
+    with file_lock(os.path.join(cache_dir, 'cache.lock')):
+        prefixes = get_immutable_prefixes()
+        if url_prefix not in prefixes:
+            write_json(get_immutable_prefixes_path(), prefixes + [url_prefix])
+
+
+def is_immutable(url, metadata):
+    return metadata.get('immutable', False) or any(url.startswith(prefix) for prefix in get_immutable_prefixes())
+
+
+def write_json(path, data):
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, 'w') as temp_file:
+        json.dump(data, temp_file)
+    os.replace(temp_path, path)
+
+
+def read_metadata(entry_path):
+    try:
+        with open(entry_path + '.meta') as metadata_file:
+            return json.load(metadata_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_metadata(url, entry_path, response_headers, immutable):
+    write_json(entry_path + '.meta', {
+        'url': url,
+        'etag': response_headers.get('ETag'),
+        'last_modified': response_headers.get('Last-Modified'),
+        'immutable': immutable,
+    })
+
+
+def get_ranged_download(url, entry_path):
+    """
+    RangedDownload of url into entry_path and response headers of HEAD request
+    if the file is big enough and the server supports byte ranges, otherwise (None, None)
+    """
+    response = http_session.head(url)
+    size = int(response.headers.get('Content-Length', 0))
+    if response.headers.get('Accept-Ranges') != 'bytes' or response.headers.get('Content-Encoding') \
+            or size < ranged_download_min_size:
+        return None, None
+    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+    return RangedDownload(url, entry_path, size, validator), response.headers
+
+
+def download_entry(url, entry_path, metadata, immutable):
+    """
+    download url into the cache. if there is a cached copy with ETag or Last-Modified from the previous download
+    then the request is conditional and the file is downloaded only if it was changed.
+    big files which are not cached yet are downloaded by byte ranges in parallel.
+    """
+    start_time = time.time()
+    headers = {}
+    if os.path.exists(entry_path):
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        response_headers = download_to(url, entry_path, headers)
+    else:
+        download, response_headers = get_ranged_download(url, entry_path)
+        if download is not None:
+            download.start().wait()
+        else:
+            response_headers = download_to(url, entry_path)
+
+    if response_headers is None:
+        # not modified
+        return
+
+    write_metadata(url, entry_path, response_headers, immutable)
+    print("downloading of {} to cache took {} seconds".format(url, time.time() - start_time))
+
+
+def cached_path(path, immutable=False):
+    """
+    local path to read `path` from. local paths are returned as is,
+    remote files are downloaded into the cache and then read from there.
+    cached copies are revalidated by conditional requests (one round trip if the file was not changed),
+    unless the file is immutable (immutable=True now or before, or see mark_immutable).
+    """
+    if not is_remote(path):
+        return path
+
+    entry_path = get_cache_entry_path(path)
+    metadata = read_metadata(entry_path)
+    if not os.path.exists(entry_path) or not is_immutable(path, metadata):
+        # only one process downloads a file, others wait for it and use the result
+        with file_lock(entry_path + '.lock'):
+            entry_exists = os.path.exists(entry_path)
+            metadata = read_metadata(entry_path)
+            if not entry_exists:
+                download_entry(path, entry_path, metadata, immutable)
+            elif not is_immutable(path, metadata):
+                try:
+                    download_entry(path, entry_path, metadata, immutable)
+                except requests.ConnectionError as error:
+                    print("can not revalidate {}, cached copy is used: {}".format(path, error))
+        if not entry_exists:
+            evict(keep=entry_path)
+
+    # modification time is used as the last access time for LRU eviction
+    os.utime(entry_path)
+    return entry_path
+
+
+def get_version(path, immutable=False):
+    """
+    version of the content of `path`, files derived from it (indexes, manifests) are valid only for that version:
+    ETag, Last-Modified or size of the cached copy of a remote file (the copy is revalidated first),
+    size and modification time of a local file. None if the file does not exist.
+    """
+    if not is_remote(path):
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        return "{}-{}".format(stat.st_size, stat.st_mtime_ns)
+
+    entry_path = cached_path(path, immutable)
+    metadata = read_metadata(entry_path)
+    return metadata.get('etag') or metadata.get('last_modified') or "{}".format(os.path.getsize(entry_path))
+
+
+def start_background_download(url, immutable):
+    """
+    start downloading of a big remote file which is not cached yet in background threads.
+    returns the RangedDownload or None if the file is cached already or is not suitable for ranged download.
+    the cache entry lock is held until the download is finished.
+    """
+    entry_path = get_cache_entry_path(url)
+    if os.path.exists(entry_path):
+        return None
+
+    lock_file = acquire_lock(entry_path + '.lock')
+    try:
+        download = None
+        if not os.path.exists(entry_path):
+            download, response_headers = get_ranged_download(url, entry_path)
+        if download is None:
+            release_lock(lock_file)
+            return None
+        download.start()
+    except BaseException:
+        release_lock(lock_file)
+        raise
+
+    def finish():
+        start_time = time.time()
+        try:
+            download.wait()
+            write_metadata(url, entry_path, response_headers, immutable)
+            print("downloading of {} to cache took {} seconds".format(url, time.time() - start_time))
+        except Exception as error:
+            print("downloading of {} failed: {}".format(url, error))
+        finally:
+            with active_downloads_lock:
+                active_downloads.pop(url, None)
+            release_lock(lock_file)
+        evict(keep=entry_path)
+
+    with active_downloads_lock:
+        active_downloads[url] = download
+    threading.Thread(target=finish, daemon=True).start()
+    return download
+
+
+def open_cached(path, immutable=False):
+    """
+    binary stream to read `path` from.
+    a big remote file which is not cached yet is downloaded in parallel in background,
+    and the stream gives its beginning while later parts are still being downloaded,
+    so parsing starts right away instead of after the whole download.
+    """
+    if is_remote(path):
+        with active_downloads_lock:
+            download = active_downloads.get(path)
+        if download is None:
+            download = start_background_download(path, immutable)
+        if download is not None:
+            return download.open_reader()
+    return open(cached_path(path, immutable), 'rb')
+
+
+def get_cache_entries():
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            if file_name.endswith(service_suffixes):
+                continue
+            if dir_path == cache_dir and file_name in service_files:
+                continue
+            entries.append(os.path.join(dir_path, file_name))
+    return entries
+
+
+def get_partial_downloads():
+    """
+    part files of ranged downloads (see downloads.RangedDownload) which are running or were interrupted
+    """
+    part_paths = []
+    if not os.path.isdir(cache_dir):
+        return part_paths
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            if file_name.endswith('.part'):
+                part_paths.append(os.path.join(dir_path, file_name))
+    return part_paths
+
+
+def remove_partial_download(part_path):
+    """
+    remove part file of an interrupted download, returns False if the download is running (its entry is locked)
+    """
+    lock_file = try_acquire_lock(part_path[:-len('.part')] + '.lock')
+    if lock_file is None:
+        return False
+    try:
+        for file_path in [part_path, part_path + '.json']:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    finally:
+        release_lock(lock_file)
+    return True
+
+
+def evict(size_limit=None, keep=None):
+    """
+    remove the least recently used files until the cache is not bigger than size_limit (cache_size_limit by default).
+    part files of interrupted downloads are counted and removed as well, part files of running downloads are counted.
+    """
+    if size_limit is None:
+        size_limit = cache_size_limit
+
+    with file_lock(os.path.join(cache_dir, 'cache.lock')):
+        entries = []
+        for entry_path in get_cache_entries() + get_partial_downloads():
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= size_limit:
+                break
+            if entry_path == keep:
+                continue
+            if entry_path.endswith('.part'):
+                if not remove_partial_download(entry_path):
+                    continue
+            else:
+                with file_lock(entry_path + '.lock'):
+                    for file_path in [entry_path, entry_path + '.meta']:
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+            total_size = total_size - size
+
+
+def clear():
+    evict(size_limit=0)
@@ -1,6 +1,7 @@
+from .cache import cached_path, open_cached
 from .library import get_output_path_from_s3_url
 import pandas as pd
-import urllib.request, json
+import json
 
 
 class RideHailReference:
@@ -43,7 +44,7 @@ class RideHailReference:
 
     @staticmethod
     def taxi_usage_json_to_dataframes(json_path):
-        json_url = urllib.request.urlopen(json_path)
+        json_url = open_cached(json_path)
         data = json.loads(json_url.read())
         data.pop('tlc_date', None)
         data.pop('fhv_date', None)
@@ -67,10 +68,10 @@ class RideHailDashboard:
     def __init__(self, s3url, iteration):
         # General code to get output path fro S3 URL
         s3path = get_output_path_from_s3_url(s3url)
-        self.passenger_per_trip_df = pd.read_csv(
-            s3path + "/ITERS/it.{0}/{0}.passengerPerTripRideHail.csv".format(iteration))
-        self.fleet_size = len(
-            pd.read_csv(s3path + "/ITERS/it.{0}/{0}.rideHailFleet.csv.gz".format(iteration))['id'].unique())
+        self.passenger_per_trip_df = pd.read_csv(cached_path(
+            s3path + "/ITERS/it.{0}/{0}.passengerPerTripRideHail.csv".format(iteration)))
+        self.fleet_size = len(pd.read_csv(
+            cached_path(s3path + "/ITERS/it.{0}/{0}.rideHailFleet.csv.gz".format(iteration)))['id'].unique())
 
     def get_number_of_shared_trips(self):
         return int(self.passenger_per_trip_df[["2", "3", "4", "5", "6"]].sum().sum())
@@ -0,0 +1,196 @@
+"""
+parallel download of big files by byte ranges.
+segments are downloaded in several threads into `<path>.part`, completed segments are recorded in
+`<path>.part.json`, so an interrupted download continues from where it stopped.
+the file could be read sequentially while later segments are still being downloaded.
+"""
+import io
+import json
+import os
+import threading
+
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from . import http_session
+
+segment_size = 16 * 1024 * 1024
+parallel_segments = 8
+
+
+class RangedDownload:
+    def __init__(self, url, path, size, validator=None):
+        """
+        size - expected size of the file in bytes
+        validator - ETag or Last-Modified of the file, a partial download with other validator is started over
+        """
+        self.url = url
+        self.path = path
+        self.size = size
+        self.validator = validator
+        self.part_path = path + '.part'
+        self.state_path = path + '.part.json'
+        self.segments = [(start, min(start + segment_size, size)) for start in range(0, size, segment_size)]
+        self.completed = set()
+        self.error = None
+        self.finished = False
+        self.condition = threading.Condition()
+        self.executor = None
+        self.futures = []
+
+    def load_state(self):
+        if not os.path.exists(self.state_path) or not os.path.exists(self.part_path):
+            return
+        with open(self.state_path) as state_file:
+            state = json.load(state_file)
+        if state.get('size') == self.size and state.get('validator') == self.validator \
+                and state.get('segment_size') == segment_size:
+            self.completed = set(state['completed'])
+
+    def save_state(self):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump({'url': self.url, 'size': self.size, 'validator': self.validator,
+                       'segment_size': segment_size, 'completed': sorted(self.completed)}, state_file)
+        os.replace(temp_path, self.state_path)
+
+    def start(self):
+        self.load_state()
+        if self.completed:
+            print("resuming download of {}, {} of {} segments are already downloaded"
+                  .format(self.url, len(self.completed), len(self.segments)))
+        else:
+            with open(self.part_path, 'wb') as part_file:
+                part_file.truncate(self.size)
+            self.save_state()
+
+        self.executor = ThreadPoolExecutor(max_workers=parallel_segments)
+        # segments are taken by threads in order, so the beginning of the file is available first
+        self.futures = [self.executor.submit(self.download_segment, idx)
+                        for idx in range(len(self.segments)) if idx not in self.completed]
+        self.executor.shutdown(wait=False)
+        return self
+
+    def download_segment(self, idx):
+        start, end = self.segments[idx]
+        if self.error is not None:
+            return
+        try:
+            headers = {'Range': 'bytes={}-{}'.format(start, end - 1)}
+            if self.validator:
+                # if the file was changed the server sends it whole instead of the range
+                headers['If-Range'] = self.validator
+            with http_session.get(self.url, headers=headers, stream=True) as response:
+                if response.status_code != 206:
+                    raise IOError("server did not return range {}-{} of {}".format(start, end, self.url))
+                with open(self.part_path, 'r+b') as part_file:
+                    part_file.seek(start)
+                    written = 0
+                    for data in response.iter_content(1024 * 1024):
+                        if self.error is not None:
+                            # the download failed or was cancelled, the part file is not written anymore
+                            return
+                        part_file.write(data)
+                        written = written + len(data)
+            if written != end - start:
+                raise IOError("got {} bytes instead of {} for range {}-{} of {}"
+                              .format(written, end - start, start, end, self.url))
+            with self.condition:
+                self.completed.add(idx)
+                self.save_state()
+                self.condition.notify_all()
+        except Exception as error:
+            with self.condition:
+                if self.error is None:
+                    self.error = error
+                self.condition.notify_all()
+            for future in self.futures:
+                future.cancel()
+
+    def cancel(self):
+        """
+        stop the download: segments which are not started yet are cancelled, running ones stop at the next read.
+        returns when no segment is running, so nothing is written into the part file after that.
+        """
+        with self.condition:
+            if self.error is None:
+                self.error = IOError("download of {} is cancelled".format(self.url))
+            self.condition.notify_all()
+        for future in self.futures:
+            future.cancel()
+        futures.wait(self.futures)
+
+    def is_segment_ready(self, idx):
+        return idx in self.completed
+
+    def wait_for_segment(self, idx):
+        with self.condition:
+            while not self.is_segment_ready(idx) and self.error is None:
+                self.condition.wait()
+            if not self.is_segment_ready(idx):
+                raise IOError("download of {} failed: {}".format(self.url, self.error))
+
+    def wait(self):
+        """
+        wait for all segments, verify the size and move the downloaded file to its path.
+        if some segment failed the rest of them are cancelled before the error is raised.
+        """
+        try:
+            for idx in range(len(self.segments)):
+                self.wait_for_segment(idx)
+        except IOError:
+            self.cancel()
+            raise
+        with self.condition:
+            if not self.finished:
+                actual_size = os.path.getsize(self.part_path)
+                if actual_size != self.size:
+                    raise IOError("downloaded {} bytes instead of {} of {}".format(actual_size, self.size, self.url))
+                os.replace(self.part_path, self.path)
+                os.remove(self.state_path)
+                self.finished = True
+
+    def open_reader(self):
+        """
+        file-like object to read the file from the beginning, it waits for segments which are not downloaded yet
+        """
+        return io.BufferedReader(SegmentedFileReader(self), buffer_size=1024 * 1024)
+
+
+class SegmentedFileReader(io.RawIOBase):
+    def __init__(self, download):
+        self.download = download
+        self.position = 0
+        self.file = None
+
+    def readable(self):
+        return True
+
+    def open_file(self):
+        # the part file is renamed when the download is finished.
+        # it is not buffered, read-ahead would keep zeros of segments which are not downloaded yet
+        with self.download.condition:
+            if self.download.finished:
+                return open(self.download.path, 'rb', buffering=0)
+            return open(self.download.part_path, 'rb', buffering=0)
+
+    def readinto(self, buffer):
+        if self.position >= self.download.size:
+            return 0
+
+        idx = self.position // segment_size
+        self.download.wait_for_segment(idx)
+        if self.file is None:
+            self.file = self.open_file()
+
+        segment_end = self.download.segments[idx][1]
+        to_read = min(len(buffer), segment_end - self.position)
+        self.file.seek(self.position)
+        data = self.file.read(to_read)
+        buffer[:len(data)] = data
+        self.position = self.position + len(data)
+        return len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        super().close()
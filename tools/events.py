@@ -1,78 +1,1601 @@
+import functools
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import weakref
+import numpy as np
 import pandas as pd
 import time
 
-from .library import get_output_path_from_s3_url
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pandas.api.types import union_categoricals
+from urllib.parse import urlparse
+from .cache import cached_path, open_cached, get_version
 
 
-def load_events(events_path, chunk_filter, chunksize=100000):
+# dtypes of columns of BEAM events by event type.
+# columns which are not mentioned here (ids, links, etc) are read as `str`.
+events_schemas = {
+    'ModeChoice': {
+        'mode': 'category',
+        'currentTourMode': 'category',
+        'length': 'float64',
+        'expectedMaximumUtility': 'float64',
+        'personalVehicleAvailable': 'boolean',
+        'tourIndex': 'Int32',
+    },
+    'PathTraversal': {
+        'mode': 'category',
+        'vehicleType': 'category',
+        'primaryFuelType': 'category',
+        'secondaryFuelType': 'category',
+        'length': 'float64',
+        'numPassengers': 'Int32',
+        'capacity': 'Int32',
+        'seatingCapacity': 'Int32',
+        'departureTime': 'Int32',
+        'arrivalTime': 'Int32',
+        'startX': 'float64',
+        'startY': 'float64',
+        'endX': 'float64',
+        'endY': 'float64',
+        'primaryFuel': 'float64',
+        'secondaryFuel': 'float64',
+        'primaryFuelLevel': 'float64',
+        'secondaryFuelLevel': 'float64',
+        'tollPaid': 'float64',
+        'fromStopIndex': 'Int32',
+        'toStopIndex': 'Int32',
+    },
+    'PersonEntersVehicle': {},
+    'PersonLeavesVehicle': {},
+    'actstart': {
+        'actType': 'category',
+    },
+    'actend': {
+        'actType': 'category',
+    },
+    'departure': {
+        'legMode': 'category',
+    },
+    'arrival': {
+        'legMode': 'category',
+    },
+    'Replanning': {
+        'reason': 'category',
+    },
+    'PersonCost': {
+        'mode': 'category',
+        'incentive': 'float64',
+        'tollCost': 'float64',
+        'netCost': 'float64',
+    },
+    'ParkingEvent': {
+        'parkingType': 'category',
+        'pricingModel': 'category',
+        'chargingPointType': 'category',
+        'score': 'float64',
+        'cost': 'float64',
+        'locationX': 'float64',
+        'locationY': 'float64',
+    },
+    'LeavingParkingEvent': {
+        'parkingType': 'category',
+        'pricingModel': 'category',
+        'chargingPointType': 'category',
+        'score': 'float64',
+        'cost': 'float64',
+        'locationX': 'float64',
+        'locationY': 'float64',
+    },
+    'RefuelSessionEvent': {
+        'parkingType': 'category',
+        'pricingModel': 'category',
+        'chargingPointType': 'category',
+        'fuel': 'float64',
+        'duration': 'float64',
+        'price': 'float64',
+        'locationX': 'float64',
+        'locationY': 'float64',
+    },
+}
+
+# columns of all event types
+events_common_schema = {
+    'time': 'int32',
+    'type': 'category',
+}
+
+
+def read_events_header(events_path):
+    """
+    names of columns of events file
+    """
+    with open_events_file(events_path) as stream:
+        return list(pd.read_csv(io.StringIO(stream.readline().decode('utf-8')), nrows=0).columns)
+
+
+def get_events_schema(events_path, event_types=None, columns=None):
+    """
+    dtypes for reading of events file.
+    if event_types are specified only schemas of these types are used, otherwise schemas of all types.
+    if columns are specified only these of them which exist in the file are included (plus 'time' and 'type').
+    """
+    file_columns = read_events_header(events_path)
+    if columns is not None:
+        columns = set(columns).union(events_common_schema.keys())
+        file_columns = [col for col in file_columns if col in columns]
+    if event_types is None:
+        event_types = events_schemas.keys()
+
+    typed_columns = dict(events_common_schema)
+    for event_type in event_types:
+        typed_columns.update(events_schemas.get(event_type, {}))
+
+    # `str` for everything that is not typed
+    return {col: typed_columns.get(col, str) for col in file_columns}
+
+
+def concat_events(dfs):
+    """
+    concatenate chunks of events keeping categorical columns categorical
+    (categories of each chunk are different, so pd.concat would turn them into `object`).
+    chunks without values of a column (i.e. no events of a type having it) have categories of `object` dtype
+    which could not be united with `str` categories of other chunks, so they are left out of the union.
+    """
+    dfs = list(dfs)
+    if not dfs:
+        return pd.DataFrame()
+    categories = {}
+    for column, dtype in dfs[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns = [df[column] for df in dfs if column in df.columns and len(df[column].cat.categories) > 0]
+            if columns:
+                categories[column] = pd.CategoricalDtype(union_categoricals(columns).categories)
+
+    if categories:
+        dfs = [df.astype({col: dtype for col, dtype in categories.items() if col in df.columns}) for df in dfs]
+    return pd.concat(dfs)
+
+
+def read_events_chunks(events_path, chunksize=100000, event_types=None, columns=None, start=0):
+    """
+    events file by chunks of rows. if start is specified (offset of the beginning of a line in decompressed file)
+    reading starts from there.
+    """
+    schema = get_events_schema(events_path, event_types, columns)
+    # read from stream, so parsing of remote file starts while the file is still being downloaded
+    if start > 0:
+        return pd.read_csv(open_events_file(events_path, start), low_memory=False, chunksize=chunksize, dtype=schema,
+                           header=None, names=read_events_header(events_path), usecols=list(schema.keys()))
+    return pd.read_csv(open_events_file(events_path), low_memory=False, chunksize=chunksize, dtype=schema,
+                       usecols=list(schema.keys()))
+
+
+def get_events_gzip_index_path(events_path):
+    return get_events_sidecar_path(events_path, '.gzidx')
+
+
+def is_events_gzip_index_present(events_path):
+    return is_sidecar_current(get_events_gzip_index_path(events_path), events_path)
+
+
+def build_events_gzip_index(events_path, spacing=16 * 1024 * 1024):
+    """
+    build an index of seek points of the gzip stream of events file and save it next to the file.
+    the index keeps decompressor state every `spacing` bytes of decompressed data (zran checkpoints),
+    so open_events_file could start decompressing at any offset
+    and load_events(processes=N) decompresses different parts of the file in different processes.
+    requires indexed_gzip.
+    """
+    import indexed_gzip
+
+    start_time = time.time()
+    index_path = get_events_gzip_index_path(events_path)
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    with indexed_gzip.IndexedGzipFile(cached_path(events_path), spacing=spacing) as stream:
+        stream.build_full_index()
+        stream.export_index(index_path + '.tmp')
+    os.replace(index_path + '.tmp', index_path)
+    write_sidecar_version(index_path, events_path)
+    print("events file:", events_path)
+    print("building of gzip index took %s seconds" % (time.time() - start_time))
+    return index_path
+
+
+def open_events_file(events_path, offset=0):
+    """
+    binary stream of decompressed content of events file, either local or remote (url, read through the cache),
+    positioned at `offset` of decompressed content.
+    if there is a gzip index (see build_events_gzip_index) the seek is immediate,
+    otherwise everything before the offset is decompressed and skipped.
+    """
+    if is_events_gzip_index_present(events_path):
+        return open_indexed_events_file(cached_path(events_path), get_events_gzip_index_path(events_path), offset)
+
+    stream = open_cached(events_path)
+    if events_path.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream)
+
+    if offset > 0:
+        if stream.seekable():
+            stream.seek(offset)
+        else:
+            while offset > 0:
+                skipped = len(stream.read(min(offset, 16 * 1024 * 1024)))
+                if skipped == 0:
+                    break
+                offset = offset - skipped
+    return stream
+
+
+def open_indexed_events_file(local_path, index_path, offset=0):
+    """
+    decompressed stream of local (or cached) events file with gzip index, positioned at `offset`
+    """
+    import indexed_gzip
+    stream = indexed_gzip.IndexedGzipFile(local_path, index_file=index_path)
+    stream.seek(offset)
+    return stream
+
+
+def get_events_uncompressed_size(events_path):
+    with open_events_file(events_path) as stream:
+        return stream.seek(0, os.SEEK_END)
+
+
+def get_event_types_pattern(header, event_types):
+    """
+    regex which matches (a superset of) lines with `type` field equal to one of event_types
+    """
+    columns = header.decode('utf-8').strip().split(',')
+    type_idx = [col.strip('"') for col in columns].index('type')
+    types = b'|'.join(re.escape(event_type.encode('utf-8')) for event_type in event_types)
+    if type_idx == 0:
+        # multiline, so the beginning of every line matches `^`, not only of the block
+        return re.compile(rb'^"?(?:' + types + rb')"?,', re.MULTILINE)
+    elif type_idx == len(columns) - 1:
+        return re.compile(rb',"?(?:' + types + rb')"?\r?(?:\n|$)')
+    else:
+        return re.compile(rb',"?(?:' + types + rb')"?,')
+
+
+def read_events_blocks(events_path, block_size=16 * 1024 * 1024, start=0, end=None, open_stream=None):
+    """
+    read decompressed events file by blocks of bytes which contain only whole lines.
+    the first yielded item is the header.
+    if start or end offsets are specified only lines starting inside [start, end) are read.
+    open_stream(offset) opens the decompressed file, open_events_file is used if it is not specified.
+    """
+    if open_stream is None:
+        open_stream = functools.partial(open_events_file, events_path)
+    stream = open_stream(0)
+    try:
+        header = stream.readline()
+        yield header
+
+        if start > len(header):
+            stream.close()
+            stream = open_stream(start - 1)
+            # skip the end of line which started before `start`
+            position = start - 1 + len(stream.readline())
+        else:
+            position = len(header)
+
+        rest = b''
+        while end is None or position < end:
+            to_read = block_size if end is None else min(block_size, end - position)
+            data = stream.read(to_read)
+            position = position + len(data)
+            block = rest + data
+            if end is not None and position >= end and not block.endswith(b'\n'):
+                # the last line started before `end`, read it completely
+                block = block + stream.readline()
+            elif data:
+                last_line_end = block.rfind(b'\n') + 1
+                block, rest = block[:last_line_end], block[last_line_end:]
+            if block:
+                yield block
+            if not data:
+                break
+    finally:
+        stream.close()
+
+
+def find_lines(pattern, block):
+    lines = []
+    pos = 0
+    while True:
+        match = pattern.search(block, pos)
+        if not match:
+            break
+        line_start = block.rfind(b'\n', 0, match.end() - 1) + 1
+        line_end = block.find(b'\n', match.end() - 1)
+        if line_end == -1:
+            line_end = len(block)
+        lines.append(block[line_start:line_end])
+        pos = line_end + 1
+    return lines
+
+
+def read_events_lines_of_types(events_path, event_types, block_size=16 * 1024 * 1024, start=0, end=None):
+    """
+    scan decompressed events file block by block without parsing it as CSV.
+    the first yielded item is the header, then lists of lines which look like events of requested types.
+    """
+    blocks = read_events_blocks(events_path, block_size, start, end)
+    header = next(blocks)
+    yield header
+
+    pattern = get_event_types_pattern(header, event_types)
+    for block in blocks:
+        yield find_lines(pattern, block)
+
+
+def parse_events_lines(header, lines, schema, event_types=None):
+    df = pd.read_csv(io.BytesIO(header + b'\n'.join(lines)), low_memory=False, dtype=schema,
+                     usecols=list(schema.keys()))
+    if event_types is not None:
+        df = df[df['type'].isin(event_types)]
+    return df
+
+
+def read_events_chunks_of_types(events_path, event_types, chunksize=100000, columns=None, start=0):
+    """
+    the same as read_events_chunks followed by filtering by event type, but only lines of
+    requested types are given to CSV parser.
+    if there is a manifest of the file (see build_events_manifest) then regions without these types are skipped.
+    """
+    schema = get_events_schema(events_path, event_types, columns)
+    manifest = load_events_manifest(events_path)
+    end = None
+    if manifest is not None:
+        region_start, end = get_events_region(manifest, event_types)
+        start = max(start, region_start)
+    lines_blocks = read_events_lines_of_types(events_path, event_types, start=start, end=end)
+    header = next(lines_blocks)
+
+    lines_to_parse = []
+    parsed_any = False
+    for lines in lines_blocks:
+        lines_to_parse.extend(lines)
+        if len(lines_to_parse) >= chunksize:
+            yield parse_events_lines(header, lines_to_parse, schema, event_types)
+            parsed_any = True
+            lines_to_parse = []
+    if lines_to_parse or not parsed_any:
+        yield parse_events_lines(header, lines_to_parse, schema, event_types)
+
+
+# everything worker processes need to parse a block, set before the pool is forked
+# because chunk_filter might be a lambda which can not be pickled
+parallel_parsing_state = {}
+
+
+def parse_events_block(block):
+    header = parallel_parsing_state['header']
+    pattern = parallel_parsing_state['pattern']
+    event_types = parallel_parsing_state['event_types']
+    chunk_filter = parallel_parsing_state['chunk_filter']
+
+    if pattern is None:
+        df = pd.read_csv(io.BytesIO(header + block), low_memory=False, dtype=parallel_parsing_state['schema'],
+                         usecols=list(parallel_parsing_state['schema'].keys()))
+    else:
+        df = parse_events_lines(header, find_lines(pattern, block), parallel_parsing_state['schema'], event_types)
+    return df[chunk_filter(df)]
+
+
+def parse_events_range(start, end):
+    # the local path and the index are found by the parent process, so workers do not revalidate the cached copy
+    open_stream = functools.partial(open_indexed_events_file, parallel_parsing_state['local_path'],
+                                    parallel_parsing_state['index_path'])
+    blocks = read_events_blocks(parallel_parsing_state['events_path'], parallel_parsing_state['block_size'],
+                                start, end, open_stream)
+    next(blocks)
+    return concat_events([parse_events_block(block) for block in blocks] or [parse_events_block(b'')])
+
+
+def read_filtered_events_chunks_parallel(events_path, chunk_filter, processes, event_types=None, columns=None,
+                                         block_size=16 * 1024 * 1024, start=0):
+    """
+    parse (and filter) line-aligned blocks of events file in a pool of processes.
+    yields already filtered chunks in the file order.
+    if there is a gzip index of the file (see build_events_gzip_index) then every process decompresses
+    its own part of the file, otherwise the file is decompressed in the current process.
+    """
+    schema = get_events_schema(events_path, event_types, columns)
+    blocks = read_events_blocks(events_path, block_size, start=start)
+    header = next(blocks)
+    pattern = None if event_types is None else get_event_types_pattern(header, event_types)
+
+    parallel_parsing_state.update(events_path=events_path, block_size=block_size, header=header, pattern=pattern,
+                                  event_types=event_types, chunk_filter=chunk_filter, schema=schema)
+
+    if is_events_gzip_index_present(events_path):
+        blocks.close()
+        local_path, index_path = cached_path(events_path), get_events_gzip_index_path(events_path)
+        parallel_parsing_state.update(local_path=local_path, index_path=index_path)
+        with open_indexed_events_file(local_path, index_path) as stream:
+            size = stream.seek(0, os.SEEK_END)
+        range_size = max(block_size, size // (processes * 4) + 1)
+        tasks = [(parse_events_range, range_start, min(range_start + range_size, size))
+                 for range_start in range(max(len(header), start), size, range_size)]
+    else:
+        tasks = ((parse_events_block, block) for block in blocks)
+
+    parsed_any = False
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        # to not keep the whole decompressed file in memory only a few tasks per process are queued
+        futures = deque()
+        for task in tasks:
+            futures.append(executor.submit(*task))
+            if len(futures) >= 2 * processes:
+                parsed_any = True
+                yield futures.popleft().result()
+        while futures:
+            parsed_any = True
+            yield futures.popleft().result()
+
+    parallel_parsing_state.clear()
+    if not parsed_any:
+        yield parse_events_lines(header, [], schema)
+
+
+# local folder for files derived from remote events files (columnar copies, manifests)
+events_datasets_dir = os.path.join(os.path.expanduser("~"), ".beam_python_tools", "events")
+
+
+def get_events_sidecar_path(events_path, extension):
+    """
+    path to a file derived from events file, i.e. '0.events.csv.gz' -> '0.events' + extension.
+    for local files it is next to the file, for remote files it is inside `events_datasets_dir`.
+    """
+    parsed = urlparse(events_path)
+    if parsed.scheme in ('http', 'https', 's3'):
+        events_path = os.path.join(events_datasets_dir, parsed.netloc, parsed.path.lstrip('/'))
+    for file_extension in ['.gz', '.csv']:
+        if events_path.endswith(file_extension):
+            events_path = events_path[:-len(file_extension)]
+    return events_path + extension
+
+
+def write_sidecar_version(sidecar_path, events_path):
+    """
+    record the version of events file (see cache.get_version) a sidecar file was built from
+    """
+    with open(sidecar_path + '.version.tmp', 'w') as version_file:
+        version_file.write(get_version(events_path) or '')
+    os.replace(sidecar_path + '.version.tmp', sidecar_path + '.version')
+
+
+def is_sidecar_current(sidecar_path, events_path):
+    """
+    True if the sidecar file exists and was built from the current version of events file,
+    i.e. it is not current after the cached copy of a remote file was replaced by a newer one
+    """
+    if not os.path.exists(sidecar_path):
+        return False
+    try:
+        with open(sidecar_path + '.version') as version_file:
+            sidecar_version = version_file.read()
+    except FileNotFoundError:
+        return False
+    return sidecar_version == (get_version(events_path) or '')
+
+
+def get_events_dataset_path(events_path):
+    """
+    path to the columnar (parquet) copy of events file partitioned by event type.
+    """
+    return get_events_sidecar_path(events_path, '.parquet')
+
+
+def is_events_dataset_present(dataset_path, events_path):
+    """
+    True if the conversion to the dataset was completed and the events file was not changed since
+    """
+    return os.path.exists(os.path.join(dataset_path, '_SUCCESS')) and is_sidecar_current(dataset_path, events_path)
+
+
+def convert_events_to_parquet(events_path, dataset_path=None, chunksize=1000000):
+    """
+    convert events.csv.gz into a local parquet dataset with one folder per event type:
+        <dataset_path>/type=ModeChoice/part-00000.parquet
+    after that load_events and get_events_for_type read only folders of requested types.
+    requires pyarrow.
+    """
+    import pyarrow  # noqa: F401 fail early if parquet engine is not available
+
+    start_time = time.time()
+    if dataset_path is None:
+        dataset_path = get_events_dataset_path(events_path)
+
+    temp_path = dataset_path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+
+    for chunk_idx, chunk in enumerate(read_events_chunks(events_path, chunksize)):
+        for event_type, df in chunk.groupby('type', observed=True):
+            type_path = os.path.join(temp_path, 'type={}'.format(event_type))
+            os.makedirs(type_path, exist_ok=True)
+            df.to_parquet(os.path.join(type_path, 'part-{:05d}.parquet'.format(chunk_idx)), index=False)
+
+    open(os.path.join(temp_path, '_SUCCESS'), 'w').close()
+    shutil.rmtree(dataset_path, ignore_errors=True)
+    os.rename(temp_path, dataset_path)
+    write_sidecar_version(dataset_path, events_path)
+
+    print("events file url:", events_path)
+    print("conversion to {} took {} seconds".format(dataset_path, time.time() - start_time))
+    return dataset_path
+
+
+def read_parquet_parts(part_paths, columns=None):
+    """
+    read parquet files one by one, columns which are missing in a file are skipped
+    """
+    import pyarrow.parquet
+
+    for part_path in part_paths:
+        if columns is None:
+            yield pd.read_parquet(part_path)
+        else:
+            part_columns = pyarrow.parquet.read_schema(part_path).names
+            yield pd.read_parquet(part_path, columns=[col for col in columns if col in part_columns])
+
+
+def read_events_dataset_chunks(dataset_path, event_types, columns=None):
+    """
+    chunks of parquet dataset, partition after partition (so events are sorted by time only within one type)
+    """
+    if columns is not None:
+        columns = list(events_common_schema.keys()) + [col for col in columns if col not in events_common_schema]
+
+    part_paths = []
+    for event_type in event_types:
+        type_path = os.path.join(dataset_path, 'type={}'.format(event_type))
+        if os.path.isdir(type_path):
+            part_paths.extend(os.path.join(type_path, file_name) for file_name in sorted(os.listdir(type_path)))
+    return read_parquet_parts(part_paths, columns)
+
+
+def read_events_dataset(dataset_path, event_types, columns=None):
+    dfs = list(read_events_dataset_chunks(dataset_path, event_types, columns))
+    if not dfs:
+        return pd.DataFrame(columns=['time', 'type'])
+    df = concat_events(dfs).reset_index(drop=True)
+    if len(event_types) > 1:
+        df = df.sort_values('time', kind='stable', ignore_index=True)
+    return df
+
+
+def get_events_manifest_path(events_path):
+    return get_events_sidecar_path(events_path, '.manifest.json')
+
+
+def build_events_manifest(events_path, block_size=64 * 1024 * 1024):
+    """
+    scan events file once and save a small manifest next to it (or inside `events_datasets_dir` for remote files):
+        per event type: number of rows, min and max time, offsets of the first and the last rows of that type,
+        per hour: the row number and the offset of the first row after which time is not less than the hour start.
+    offsets are positions in decompressed content, so they could be used with open_events_file and read_events_blocks.
+    """
+    start_time = time.time()
+    blocks = read_events_blocks(events_path, block_size)
+    header = next(blocks)
+
+    offset = len(header)
+    rows = 0
+    max_time = float('-inf')
+    types = {}
+    hours = []
+
+    for block in blocks:
+        line_ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+        line_starts = np.concatenate([[0], line_ends + 1])
+        line_starts = line_starts[line_starts < len(block)]
+
+        # blank lines are kept in order to have one row per line
+        df = pd.read_csv(io.BytesIO(header + block), usecols=['time', 'type'], dtype={'time': 'float64', 'type': str},
+                         skip_blank_lines=False)
+        if len(df) != len(line_starts):
+            raise ValueError("unexpected multiline rows in events file {}".format(events_path))
+        df['offset'] = offset + line_starts
+
+        by_type = df.groupby('type').agg(count=('time', 'size'), min_time=('time', 'min'), max_time=('time', 'max'),
+                                         first_offset=('offset', 'min'), last_offset=('offset', 'max'))
+        for event_type, stats in by_type.iterrows():
+            if event_type not in types:
+                types[event_type] = {'count': 0, 'min_time': stats['min_time'], 'max_time': stats['max_time'],
+                                     'first_offset': int(stats['first_offset'])}
+            type_stats = types[event_type]
+            type_stats['count'] = type_stats['count'] + int(stats['count'])
+            type_stats['min_time'] = float(min(type_stats['min_time'], stats['min_time']))
+            type_stats['max_time'] = float(max(type_stats['max_time'], stats['max_time']))
+            type_stats['last_offset'] = int(stats['last_offset'])
+
+        # events are written almost in time order, so the hour boundary is
+        # where the running maximum of time reaches the hour start
+        running_max_time = np.fmax.accumulate(np.concatenate([[max_time], df['time'].values]))[1:]
+        if len(running_max_time) > 0:
+            max_time = running_max_time[-1]
+            next_hour = len(hours)
+            while next_hour * 3600 <= max_time:
+                idx = int(np.searchsorted(running_max_time, next_hour * 3600, side='left'))
+                hours.append({'hour': next_hour, 'row': rows + idx, 'offset': int(offset + line_starts[idx])})
+                next_hour = next_hour + 1
+
+        offset = offset + len(block)
+        rows = rows + len(df)
+
+    manifest = {
+        'events_path': events_path,
+        'size': offset,
+        'rows': rows,
+        'types': types,
+        'hours': hours,
+    }
+    if os.path.exists(events_path):
+        manifest['source_size'] = os.path.getsize(events_path)
+    manifest['source_version'] = get_version(events_path)
+
+    manifest_path = get_events_manifest_path(events_path)
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    print("events file url:", events_path)
+    print("building of manifest took %s seconds" % (time.time() - start_time))
+    return manifest
+
+
+def load_events_manifest(events_path):
+    """
+    manifest built by build_events_manifest or None if there is no manifest
+    (or the file was changed since, i.e. the cached copy of a remote file was replaced by a newer one)
+    """
+    manifest_path = get_events_manifest_path(events_path)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('source_version') != get_version(events_path):
+        return None
+    return manifest
+
+
+def get_events_count(events_path, event_types=None):
+    """
+    number of events (of event_types if specified) from the manifest, without reading the events file.
+    builds the manifest if it does not exist.
+    """
+    manifest = load_events_manifest(events_path)
+    if manifest is None:
+        manifest = build_events_manifest(events_path)
+    if event_types is None:
+        return sum(stats['count'] for stats in manifest['types'].values())
+    return sum(manifest['types'].get(event_type, {'count': 0})['count'] for event_type in event_types)
+
+
+def get_events_region(manifest, event_types):
+    """
+    [start, end) offsets of decompressed events file which contain all events of event_types
+    """
+    types = [manifest['types'][event_type] for event_type in event_types if event_type in manifest['types']]
+    if not types:
+        return manifest['size'], manifest['size']
+    return min(stats['first_offset'] for stats in types), max(stats['last_offset'] for stats in types) + 1
+
+
+def get_events_time_offset(manifest, start_time):
+    """
+    offset of decompressed events file before which all events are earlier than start_time
+    """
+    offset = 0
+    for hour in manifest['hours']:
+        if hour['hour'] * 3600 > start_time:
+            break
+        offset = hour['offset']
+    return offset
+
+
+def select_time_range(chunks, time_range):
+    """
+    rows of chunks with time inside [start, end).
+    events are written in time order, so reading stops at the first chunk which is entirely after the end.
+    """
+    start, end = time_range
+    selected_any = False
+    for df in chunks:
+        if len(df) > 0 and df['time'].min() >= end:
+            if not selected_any:
+                # the range is before the first event, empty chunk keeps columns and types
+                yield df.iloc[:0]
+            break
+        selected_any = True
+        yield df[(df['time'] >= start) & (df['time'] < end)]
+
+
+# columns with ids of persons and vehicles, encoded by IdDictionary in load_events
+events_id_columns = ['person', 'vehicle', 'driver']
+
+
+class IdDictionary:
+    """
+    dictionary of string ids of one run (persons, vehicles, drivers) to dense int32 codes,
+    so joins and group-bys work on integers instead of strings.
+    codes are assigned in order of appearance, one dictionary is shared by all columns
+    (so 'driver' could be compared with 'person'), missing values are encoded as -1.
+
+    ids = IdDictionary()
+    pte = load_events(events_path, lambda df: df['type'] == 'PathTraversal', id_dictionary=ids)
+    pte['vehicle_id'] = ids.decode(pte['vehicle'])
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, values):
+        # only distinct values are looked up in the dictionary
+        value_codes, unique_values = pd.factorize(values)
+        unique_codes = np.empty(len(unique_values) + 1, dtype=np.int32)
+        for idx, value in enumerate(unique_values):
+            code = self.codes.get(value)
+            if code is None:
+                code = len(self.ids)
+                self.codes[value] = code
+                self.ids.append(value)
+            unique_codes[idx] = code
+        # factorize gives -1 to missing values, the last element of unique_codes
+        unique_codes[-1] = -1
+        return unique_codes[value_codes]
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        ids = np.array(self.ids + [None], dtype=object)
+        return ids[np.where(codes >= 0, codes, len(self.ids))]
+
+    def get_code(self, value):
+        return self.codes.get(value, -1)
+
+
+# folder for events spilled to disk by load_events(memory_limit=...), system temp folder if None
+events_spill_dir = None
+
+
+class SpilledEvents:
+    """
+    events which did not fit into memory limit of load_events, stored in parquet files in a temporary folder.
+    the folder is removed when the object is garbage collected or closed.
+
+    for chunk in spilled_events:
+        ...
+    car_trips = spilled_events.query(lambda df: df['mode'] == 'car', columns=['vehicle', 'length'])
+    """
+
+    def __init__(self, path, part_paths, rows):
+        self.path = path
+        self.part_paths = part_paths
+        self.rows = rows
+        self.cleanup = weakref.finalize(self, shutil.rmtree, path, True)
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def iter_chunks(self, columns=None):
+        return read_parquet_parts(self.part_paths, columns)
+
+    def to_pandas(self, columns=None):
+        dfs = list(self.iter_chunks(columns))
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        return concat_events(dfs).reset_index(drop=True)
+
+    def query(self, chunk_filter, columns=None):
+        """
+        rows for which chunk_filter is true, only these of them are loaded into memory.
+        columns (if specified) should include all columns used by chunk_filter.
+        """
+        dfs = [df[chunk_filter(df)] for df in self.iter_chunks(columns)]
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        return concat_events(dfs).reset_index(drop=True)
+
+    def close(self):
+        self.cleanup()
+
+
+def get_empty_events(events_path, event_types=None, columns=None):
+    """
+    DataFrame without rows with the same columns and types as read_events_chunks would give
+    """
+    schema = get_events_schema(events_path, event_types, columns)
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in schema.items()})
+
+
+def or_empty_events(chunks, get_empty):
+    """
+    chunks as they are, or one empty DataFrame (given by get_empty) if there are no chunks at all
+    """
+    empty = True
+    for df in chunks:
+        empty = False
+        yield df
+    if empty:
+        yield get_empty()
+
+
+def collect_events_chunks(chunks, memory_limit=None):
+    """
+    concatenate chunks into one DataFrame, unless they take more than memory_limit bytes.
+    in that case all chunks are written into temporary parquet files and SpilledEvents is returned.
+    """
+    if memory_limit is None:
+        return concat_events(chunks)
+
+    dfs = []
+    memory_usage = 0
+    for df in chunks:
+        dfs.append(df)
+        memory_usage = memory_usage + df.memory_usage(deep=True).sum()
+        if memory_usage > memory_limit:
+            break
+    else:
+        return concat_events(dfs)
+
+    import pyarrow  # noqa: F401 fail early if parquet engine is not available
+
+    spill_path = tempfile.mkdtemp(prefix='events-', dir=events_spill_dir)
+    part_paths = []
+    rows = 0
+
+    def spill(df):
+        part_path = os.path.join(spill_path, 'part-{:05d}.parquet'.format(len(part_paths)))
+        df.to_parquet(part_path, index=False)
+        part_paths.append(part_path)
+        return len(df)
+
+    # chunks already in memory are released as soon as they are written
+    while dfs:
+        rows = rows + spill(dfs.pop(0))
+    for df in chunks:
+        rows = rows + spill(df)
+    print("events took more than {} bytes, {} rows are spilled to {}".format(memory_limit, rows, spill_path))
+    return SpilledEvents(spill_path, part_paths, rows)
+
+
+def load_events(events_path, chunk_filter, chunksize=100000, event_types=None, columns=None, processes=None,
+                memory_limit=None, time_range=None, id_dictionary=None):
+    """
+    load events filtered by chunk_filter.
+    if event_types are specified then only lines of these types are parsed, and if a parquet copy of the file
+    exists (see convert_events_to_parquet) then only partitions of these types are read.
+    chunk_filter is applied on top of them anyway.
+    if columns are specified only they (plus 'time' and 'type') are parsed,
+    so they should include all columns used by chunk_filter.
+    if processes is more than 1 then blocks of the file are parsed and filtered in that many processes
+    (requires 'fork' start method, so not available on Windows).
+    if memory_limit (in bytes) is specified and filtered events take more memory than that,
+    they are spilled to disk and SpilledEvents is returned instead of DataFrame.
+    if time_range=(start, end) is specified only events with time inside [start, end) seconds are loaded:
+    reading stops after the end and, if there is a manifest (see build_events_manifest),
+    starts from the hour of the start (that seek is fast if there is a gzip index, see build_events_gzip_index).
+    if id_dictionary (IdDictionary) is specified then 'person', 'vehicle' and 'driver' columns are encoded by it
+    into int32 codes (after chunk_filter is applied, so chunk_filter sees string ids).
+    """
     start_time = time.time()
-    # Read first 20 rows in order to get all columns
-    columns = pd.read_csv(events_path, low_memory=False, nrows=20).columns
-    schema = {}
-    # Make all of them `str` at first
-    for col in columns:
-        schema[col] = str
-    # Assign correct type for specific columns
-    schema["time"] = int
-    schema["length"] = float
-    schema['departureTime'] = pd.Int64Dtype()
-    schema['arrivalTime'] = pd.Int64Dtype()
-
-    df = pd.concat(
-        [df[chunk_filter(df)] for df in pd.read_csv(events_path, low_memory=False, chunksize=chunksize, dtype=schema)])
-    df['hour'] = (df['time'] / 3600).astype(int)
+    source_path = events_path
+    start = 0
+    if time_range is not None:
+        manifest = load_events_manifest(events_path)
+        if manifest is not None:
+            start = get_events_time_offset(manifest, time_range[0])
+
+    dataset_path = get_events_dataset_path(events_path)
+    if event_types is not None and is_events_dataset_present(dataset_path, events_path):
+        if memory_limit is None:
+            chunks = [read_events_dataset(dataset_path, event_types, columns)]
+        else:
+            chunks = read_events_dataset_chunks(dataset_path, event_types, columns)
+        if time_range is not None:
+            # partitions are read one after another, so there is no single point to stop at
+            chunks = (df[(df['time'] >= time_range[0]) & (df['time'] < time_range[1])] for df in chunks)
+        events_path = dataset_path
+    else:
+        if processes is not None and processes > 1:
+            chunks = read_filtered_events_chunks_parallel(events_path, chunk_filter, processes, event_types, columns,
+                                                          start=start)
+        elif event_types is not None:
+            chunks = read_events_chunks_of_types(events_path, event_types, chunksize, columns, start)
+        else:
+            chunks = read_events_chunks(events_path, chunksize, event_types, columns, start)
+        if time_range is not None:
+            chunks = select_time_range(chunks, time_range)
+
+    # if nothing is read (i.e. time_range is outside of the file) the result is empty but has all columns
+    chunks = or_empty_events(chunks, lambda: get_empty_events(source_path, event_types, columns))
+    # chunks of parallel reading are filtered by worker processes already, the filter is cheap to apply twice
+    chunks = (df[chunk_filter(df)] for df in chunks)
+    chunks = (df.assign(hour=(df['time'] / 3600).astype(int)) for df in chunks)
+    if id_dictionary is not None:
+        chunks = (df.assign(**{col: id_dictionary.encode(df[col]) for col in events_id_columns if col in df.columns})
+                  for df in chunks)
+
+    df = collect_events_chunks(chunks, memory_limit)
     print("events file url:", events_path)
     print("loading took %s seconds" % (time.time() - start_time))
     return df
 
 
-def load_events_from_s3_chunked(s3url, iteration, chunk_filter, chunksize=100000):
+def get_events_path_from_s3(s3url, iteration):
+    # library imports events, so it is imported here and not at the top
+    from .library import get_output_path_from_s3_url
     s3path = get_output_path_from_s3_url(s3url)
-    events_path = s3path + "/ITERS/it.{0}/{0}.events.csv.gz".format(iteration)
-    return load_events(events_path, chunk_filter, chunksize)
+    return s3path + "/ITERS/it.{0}/{0}.events.csv.gz".format(iteration)
+
+
+def load_events_from_s3_chunked(s3url, iteration, chunk_filter, chunksize=100000, event_types=None, columns=None,
+                                processes=None, memory_limit=None, time_range=None, id_dictionary=None):
+    events_path = get_events_path_from_s3(s3url, iteration)
+    return load_events(events_path, chunk_filter, chunksize, event_types, columns, processes, memory_limit,
+                       time_range, id_dictionary)
+
+
+class EventsScanner:
+    """
+    read events file once and feed every registered consumer with its own slice of each chunk.
+    by default a consumer collects its filtered rows into one DataFrame (the same as load_events does),
+    a reducer could be used instead to keep only an aggregate.
+
+    scanner = EventsScanner.from_s3(s3url, iteration)
+    scanner.add_consumer('modechoice', lambda df: df['type'] == 'ModeChoice')
+    scanner.add_consumer('actends_per_hour', lambda df: df['type'] == 'actend',
+                         reducer=lambda acc, df: acc.add(df.groupby(df['time'] // 3600).size(), fill_value=0),
+                         initial=pd.Series(dtype=float))
+    results = scanner.scan()
+    modechoice = results['modechoice']
+    """
+
+    class Consumer:
+        def __init__(self, chunk_filter, columns, reducer, initial, finalize):
+            self.chunk_filter = chunk_filter
+            self.columns = columns
+            self.reducer = reducer
+            self.finalize = finalize
+            self.state = [] if reducer is None else initial
+
+        def consume(self, chunk):
+            df = chunk[self.chunk_filter(chunk)]
+            if self.columns is not None:
+                df = df[self.columns]
+            if self.reducer is None:
+                self.state.append(df)
+            else:
+                self.state = self.reducer(self.state, df)
+
+        def result(self):
+            if self.reducer is None:
+                df = concat_events(self.state)
+                if 'time' in df.columns:
+                    df['hour'] = (df['time'] / 3600).astype(int)
+                result = df
+            else:
+                result = self.state
+            if self.finalize is not None:
+                result = self.finalize(result)
+            return result
+
+    def __init__(self, events_path, chunksize=100000, columns=None):
+        """
+        columns - optional list of columns to parse, should include everything used by consumers and their filters
+        """
+        self.events_path = events_path
+        self.chunksize = chunksize
+        self.columns = columns
+        self.consumers = {}
+
+    @staticmethod
+    def from_s3(s3url, iteration, chunksize=100000, columns=None):
+        return EventsScanner(get_events_path_from_s3(s3url, iteration), chunksize, columns)
+
+    def add_consumer(self, name, chunk_filter, columns=None, reducer=None, initial=None, finalize=None):
+        """
+        chunk_filter - function from chunk to boolean mask, the same as for load_events
+        columns - optional list of columns the consumer needs
+        reducer - optional function (state, filtered chunk) -> new state, 'initial' is the first state
+        finalize - optional function applied to the collected DataFrame or to the last state
+        """
+        if name in self.consumers:
+            raise ValueError("consumer with name '{}' is already registered".format(name))
+        self.consumers[name] = EventsScanner.Consumer(chunk_filter, columns, reducer, initial, finalize)
+        return self
+
+    def scan(self):
+        start_time = time.time()
+        for chunk in read_events_chunks(self.events_path, self.chunksize, columns=self.columns):
+            for consumer in self.consumers.values():
+                consumer.consume(chunk)
+        results = {name: consumer.result() for name, consumer in self.consumers.items()}
+        print("events file url:", self.events_path)
+        print("scanning for {} consumers took {} seconds".format(len(self.consumers), time.time() - start_time))
+        return results
 
 
-def get_events_for_type(arg, event_type):
+def get_events_for_type(arg, event_type, columns=None, time_range=None):
     df = None
     if isinstance(arg, pd.DataFrame):
         df = arg[arg['type'] == event_type]
+        if time_range is not None:
+            df = df[(df['time'] >= time_range[0]) & (df['time'] < time_range[1])]
     elif isinstance(arg, tuple):
         s3url = arg[0]
         iteration = arg[1]
-        df = load_events_from_s3_chunked(s3url, iteration, lambda df: df['type'] == event_type)
+        df = load_events_from_s3_chunked(s3url, iteration, lambda df: df['type'] == event_type,
+                                         event_types=[event_type], columns=columns, time_range=time_range)
     else:
         raise TypeError("Expect DataFrame or path, but got " + str(type(arg)))
     return df
 
 
 def get_mode_choice(arg):
-    def select_columns(df):
-        return df[['time', 'hour', 'type', 'mode', 'person', 'currentTourMode', 'availableAlternatives',
-                   'personalVehicleAvailable', 'expectedMaximumUtility', 'length', 'tourIndex', 'location']]
+    columns = ['time', 'hour', 'type', 'mode', 'person', 'currentTourMode', 'availableAlternatives',
+               'personalVehicleAvailable', 'expectedMaximumUtility', 'length', 'tourIndex', 'location']
 
-    df = get_events_for_type(arg, 'ModeChoice')
+    df = get_events_for_type(arg, 'ModeChoice', columns)
     df['hour'] = df['time'] // 3600
-    return select_columns(df)
+    return df[columns]
 
 
 def get_replanning(arg):
-    def select_columns(df):
-        return df[['time', 'hour', 'type', 'reason', 'person']]
+    columns = ['time', 'hour', 'type', 'reason', 'person']
 
-    df = get_events_for_type(arg, 'Replanning')
+    df = get_events_for_type(arg, 'Replanning', columns)
     df['hour'] = df['time'] // 3600
-    return select_columns(df)
+    return df[columns]
 
 
 def get_path_traversal(arg):
-    def select_columns(df):
-        return df[
-            ['time', 'hour', 'type', "length", "primaryFuelType", "secondaryFuelType", "primaryFuel", "secondaryFuel",
-             "numPassengers", "links", "linkTravelTime", "mode", "departureTime",
-             "arrivalTime", "vehicle", "driver", "vehicleType", "capacity", "startX", "startY", "endX", "endY",
-             "primaryFuelLevel", "secondaryFuelLevel", "tollPaid", "seatingCapacity", "fromStopIndex", "toStopIndex"]]
-
-    df = get_events_for_type(arg, 'PathTraversal')
-    df = df.astype({"person": str, "departureTime": int, "arrivalTime": int})
+    columns = ['time', 'hour', 'type', "length", "primaryFuelType", "secondaryFuelType", "primaryFuel", "secondaryFuel",
+               "numPassengers", "links", "linkTravelTime", "mode", "departureTime",
+               "arrivalTime", "vehicle", "driver", "vehicleType", "capacity", "startX", "startY", "endX", "endY",
+               "primaryFuelLevel", "secondaryFuelLevel", "tollPaid", "seatingCapacity", "fromStopIndex", "toStopIndex"]
+
+    df = get_events_for_type(arg, 'PathTraversal', columns)
     df['hour'] = df['time'] // 3600
-    return select_columns(df)
+    return df[columns]
+
+
+def parse_number_lists(values, dtype):
+    """
+    parse comma separated lists of numbers (i.e. 'links' of PathTraversal) at once.
+    returns flat array of all numbers and offsets: numbers of row i are numbers[offsets[i]:offsets[i + 1]]
+    """
+    values = pd.Series(values, dtype=object).fillna('')
+    lengths = values.str.len().values
+    not_empty = lengths > 0
+    joined = ','.join(values[not_empty])
+
+    # number of values of a row is number of commas inside it plus one
+    commas = np.flatnonzero(np.frombuffer(joined.encode('utf-8'), dtype=np.uint8) == ord(','))
+    row_ends = np.cumsum(lengths[not_empty] + 1) - 1
+    counts = np.zeros(len(values), dtype=np.int64)
+    counts[not_empty] = np.bincount(np.searchsorted(row_ends, commas), minlength=len(row_ends)) + 1
+    # commas between rows were counted for the row before them
+    counts[np.flatnonzero(not_empty)[:-1]] -= 1
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    parse_dtype = np.int64 if np.issubdtype(dtype, np.integer) else np.float64
+    numbers = np.fromstring(joined, dtype=parse_dtype, sep=',') if joined else np.empty(0, dtype=parse_dtype)
+    if len(numbers) != offsets[-1]:
+        raise ValueError("can not parse lists of numbers, got {} numbers instead of {}".format(len(numbers),
+                                                                                              offsets[-1]))
+    return numbers.astype(dtype), offsets
+
+
+def align_travel_times(offsets, travel_times, travel_time_offsets):
+    """
+    travel times for links with offsets, NaN for events where the number of travel times is not the number of links
+    """
+    counts = np.diff(offsets)
+    matched = counts == np.diff(travel_time_offsets)
+    print("numbers of links and link travel times are different for {} path traversals, "
+          "their travel times are unknown".format((~matched).sum()))
+
+    matched_counts = counts[matched]
+    # position of every link inside its event
+    positions = np.arange(matched_counts.sum()) - np.repeat(np.cumsum(matched_counts) - matched_counts, matched_counts)
+    aligned = np.full(offsets[-1], np.nan, dtype=np.float32)
+    aligned[np.repeat(offsets[:-1][matched], matched_counts) + positions] = \
+        travel_times[np.repeat(travel_time_offsets[:-1][matched], matched_counts) + positions]
+    return aligned
+
+
+class PathTraversalLinks:
+    """
+    links of PathTraversal events in compressed sparse row form:
+    links of event i are links[offsets[i]:offsets[i + 1]], their travel times are travel_times[the same slice].
+    link-level queries are numpy operations over flat arrays, i.e. number of crossings of some links per event:
+        crossed = np.isin(csr.links, some_links)
+        crossings = np.bincount(csr.get_event_indices()[crossed], minlength=len(csr))
+    """
+
+    def __init__(self, links, travel_times, offsets):
+        self.links = links
+        self.travel_times = travel_times
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def from_events(df):
+        """
+        parse 'links' and 'linkTravelTime' columns of PathTraversal events.
+        travel times of events with different numbers of links and travel times are unknown (NaN).
+        """
+        links, offsets = parse_number_lists(df['links'], np.int32)
+        if 'linkTravelTime' in df.columns:
+            travel_times, travel_time_offsets = parse_number_lists(df['linkTravelTime'], np.float32)
+            if not np.array_equal(offsets, travel_time_offsets):
+                travel_times = align_travel_times(offsets, travel_times, travel_time_offsets)
+        else:
+            travel_times = np.full(len(links), np.nan, dtype=np.float32)
+        return PathTraversalLinks(links, travel_times, offsets)
+
+    @staticmethod
+    def concat(parts):
+        parts = list(parts)
+        offsets = [np.zeros(1, dtype=np.int64)]
+        shift = 0
+        for part in parts:
+            offsets.append(part.offsets[1:] + shift)
+            shift = shift + part.offsets[-1]
+        return PathTraversalLinks(np.concatenate([part.links for part in parts] + [np.empty(0, dtype=np.int32)]),
+                                  np.concatenate([part.travel_times for part in parts] +
+                                                 [np.empty(0, dtype=np.float32)]),
+                                  np.concatenate(offsets))
+
+    def get_counts(self):
+        """
+        number of links of every event
+        """
+        return np.diff(self.offsets)
+
+    def get_event_indices(self):
+        """
+        index of event for every link of the flat array
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.get_counts())
+
+    def take(self, event_indices):
+        """
+        links of selected events (i.e. of rows of filtered DataFrame)
+        """
+        event_indices = np.asarray(event_indices)
+        if event_indices.dtype == bool:
+            event_indices = np.flatnonzero(event_indices)
+        counts = self.get_counts()[event_indices]
+        offsets = np.zeros(len(event_indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # positions in flat arrays: start of the event + position inside the event
+        positions = np.repeat(self.offsets[event_indices] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return PathTraversalLinks(self.links[positions], self.travel_times[positions], offsets)
+
+    def slice(self, start, end):
+        """
+        links of events from start to end (not including), arrays are views of arrays of this object
+        """
+        first, last = self.offsets[start], self.offsets[end]
+        return PathTraversalLinks(self.links[first:last], self.travel_times[first:last],
+                                  self.offsets[start:end + 1] - first)
+
+    def get_blocks(self, block_size):
+        """
+        (start, end) ranges of events with about block_size links in each of them
+        """
+        starts = np.searchsorted(self.offsets, np.arange(0, self.offsets[-1], block_size), side='right') - 1
+        starts = np.unique(np.append(starts, 0))
+        return list(zip(starts, np.append(starts[1:], len(self))))
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as npz_file:
+            np.savez(npz_file, links=self.links, travel_times=self.travel_times, offsets=self.offsets)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as npz:
+            return PathTraversalLinks(npz['links'], npz['travel_times'], npz['offsets'])
+
+
+def get_path_traversal_links_path(events_path):
+    return get_events_sidecar_path(events_path, '.links.npz')
+
+
+def get_path_traversal_links(events_path, chunksize=1000000):
+    """
+    links of all PathTraversal events of events file (in order of the file) in CSR form.
+    they are parsed once and saved next to the file (or inside `events_datasets_dir` for remote files),
+    and parsed again when the events file is changed.
+    """
+    links_path = get_path_traversal_links_path(events_path)
+    if is_sidecar_current(links_path, events_path):
+        return PathTraversalLinks.load(links_path)
+
+    start_time = time.time()
+    chunks = read_events_chunks_of_types(events_path, ['PathTraversal'], chunksize, ['links', 'linkTravelTime'])
+    csr = PathTraversalLinks.concat(PathTraversalLinks.from_events(df) for df in chunks)
+
+    os.makedirs(os.path.dirname(os.path.abspath(links_path)), exist_ok=True)
+    csr.save(links_path)
+    write_sidecar_version(links_path, events_path)
+    print("events file url:", events_path)
+    print("parsing of links of {} path traversals took {} seconds".format(len(csr), time.time() - start_time))
+    return csr
+
+
+def load_path_traversals(events_path, columns=None, id_dictionary=None):
+    """
+    all PathTraversal events of the file (without 'links' and 'linkTravelTime' columns) and their links in CSR form,
+    the i-th event of the DataFrame has the i-th links of PathTraversalLinks.
+    """
+    if columns is None:
+        columns = read_events_header(events_path)
+    columns = [col for col in columns if col not in ('links', 'linkTravelTime')]
+    df = load_events(events_path, lambda df: df['type'] == 'PathTraversal', event_types=['PathTraversal'],
+                     columns=columns, id_dictionary=id_dictionary)
+    csr = get_path_traversal_links(events_path)
+    if len(df) != len(csr):
+        raise ValueError("{} path traversals, but links of {}, links file {} is outdated"
+                         .format(len(df), len(csr), get_path_traversal_links_path(events_path)))
+    return df.reset_index(drop=True), csr
+
+
+def get_path_traversal_persons(df):
+    """
+    number of persons in the vehicle of every PathTraversal event: walk and bike move only the person itself,
+    car moves the driver and passengers, other vehicles (transit) count only passengers.
+    """
+    num_passengers = df['numPassengers'].astype('float64').fillna(0).values
+    mode = df['mode'].astype(object)
+    return np.select([mode.isin(['walk', 'bike']).values, (mode == 'car').values], [1, 1 + num_passengers],
+                     num_passengers)
+
+
+def get_link_entry_times(df, csr):
+    """
+    time of entering every link of csr.links: departure time of the event plus travel times of links before it,
+    NaN if travel time of some link before it is unknown
+    """
+    unknown = np.isnan(csr.travel_times)
+    travel_times = np.where(unknown, 0, csr.travel_times.astype(np.float64))
+    time_before = np.cumsum(travel_times) - travel_times
+    unknown_before = np.cumsum(unknown) - unknown
+    # cumulative values of previous events are subtracted, so the sums start from 0 for every event
+    event_start = np.append(time_before, 0)[csr.offsets[:-1]]
+    event_unknown_start = np.append(unknown_before, 0)[csr.offsets[:-1]]
+    departure_times = df['departureTime'].astype('float64').values
+    event_indices = csr.get_event_indices()
+    entry_times = departure_times[event_indices] + time_before - event_start[event_indices]
+    entry_times[unknown_before > event_unknown_start[event_indices]] = np.nan
+    return entry_times
+
+
+def sum_by_keys(keys, values):
+    """
+    sorted unique keys and sums of every array of `values` (None counts rows) for each of them
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, [np.bincount(inverse, weights=weights, minlength=len(unique_keys)) for weights in values]
+
+
+# upper bound of hour numbers in keys of calc_link_volumes_by_hour
+max_hours = 2 ** 20
+
+
+def calc_link_volumes_by_hour(df, csr, by=None, block_size=4000000):
+    """
+    volumes of links by hour from PathTraversal events and their links (see load_path_traversals):
+    'volume' is the number of vehicles which entered the link during the hour, 'persons' is the number of persons
+    in these vehicles (see get_path_traversal_persons). hour is taken by the time of entering the link.
+    if `by` column is specified (i.e. 'vehicleType') volumes are calculated for every value of it separately.
+    df should contain 'departureTime', 'mode' and 'numPassengers' columns.
+    links are processed by blocks of block_size and only used (value, link, hour) combinations are kept,
+    so memory depends on the number of them and not on the number of link traversals or the size of the network.
+    """
+    start_time = time.time()
+    df = df.reset_index(drop=True)
+    n_links = int(csr.links.max()) + 1 if len(csr.links) > 0 else 1
+    persons = get_path_traversal_persons(df)
+    if by is None:
+        codes, values = np.zeros(len(df), dtype=np.int64), pd.Index([None])
+    else:
+        codes, values = pd.factorize(df[by])
+
+    # key of (value of `by`, link, hour) is sorted in the same order as the result
+    keys = np.zeros(0, dtype=np.int64)
+    sums = [np.zeros(0), np.zeros(0)]
+    pending_keys, pending_volumes, pending_persons = [], [], []
+    pending_rows = 0
+    for start, end in csr.get_blocks(block_size):
+        block = csr.slice(start, end)
+        event_indices = block.get_event_indices() + start
+        entry_times = get_link_entry_times(df.iloc[start:end], block)
+        selected = ~np.isnan(entry_times) & (codes[event_indices] >= 0)
+        event_indices = event_indices[selected]
+        block_keys = ((codes[event_indices].astype(np.int64) * n_links + block.links[selected]) * max_hours
+                      + (entry_times[selected] // 3600).astype(np.int64))
+        block_keys, (block_volumes, block_persons) = sum_by_keys(block_keys, [None, persons[event_indices]])
+        pending_keys.append(block_keys)
+        pending_volumes.append(block_volumes)
+        pending_persons.append(block_persons)
+        pending_rows = pending_rows + len(block_keys)
+
+        # merge sums of blocks when they are as big as the merged sums, so they are not merged after every block
+        if pending_rows >= len(keys) or end == len(csr):
+            keys, sums = sum_by_keys(np.concatenate([keys] + pending_keys),
+                                     [np.concatenate([sums[0]] + pending_volumes),
+                                      np.concatenate([sums[1]] + pending_persons)])
+            pending_keys, pending_volumes, pending_persons = [], [], []
+            pending_rows = 0
+
+    result = pd.DataFrame({
+        'link': keys // max_hours % n_links,
+        'hour': keys % max_hours,
+        'volume': sums[0].astype(np.int64),
+        'persons': sums[1],
+    })
+    if by is not None:
+        result.insert(0, by, values.take(keys // max_hours // n_links))
+    print("calculation of link volumes from {} link traversals took {} seconds"
+          .format(len(csr.links), time.time() - start_time))
+    return result
+
+
+def calc_link_volumes_from_events(events_path, by=None, chunk_filter=None):
+    """
+    link volumes by hour (see calc_link_volumes_by_hour) of PathTraversal events of events file,
+    only of events for which chunk_filter is true if it is specified (i.e. lambda df: df['mode'] == 'car').
+    """
+    columns = ['departureTime', 'mode', 'numPassengers', 'vehicleType', 'vehicle']
+    if by is not None and by not in columns:
+        columns.append(by)
+    df, csr = load_path_traversals(events_path, columns)
+    if chunk_filter is not None:
+        selected = chunk_filter(df).values
+        df, csr = df[selected], csr.take(selected)
+    return calc_link_volumes_by_hour(df, csr, by)
+
+
+def calc_link_travel_times_by_hour(df, csr, links=None, percentiles=(50, 90), block_size=4000000):
+    """
+    distribution of travel times of links by hour from PathTraversal events and their links
+    (see load_path_traversals): 'count', 'mean' and a column for every percentile ('p50', 'p90', ...)
+    for every link and hour of entering the link. only links from `links` are used if it is specified.
+    percentiles are interpolated linearly, the same as numpy.percentile does.
+    """
+    start_time = time.time()
+    df = df.reset_index(drop=True)
+    selected_links = None if links is None else np.unique(np.asarray(links, dtype=np.int64))
+
+    link_parts, hour_parts, travel_time_parts = [], [], []
+    for start, end in csr.get_blocks(block_size):
+        block = csr.slice(start, end)
+        entry_times = get_link_entry_times(df.iloc[start:end], block)
+        selected = ~np.isnan(entry_times) & ~np.isnan(block.travel_times)
+        if selected_links is not None:
+            selected &= np.isin(block.links, selected_links)
+        link_parts.append(block.links[selected])
+        hour_parts.append((entry_times[selected] // 3600).astype(np.int32))
+        travel_time_parts.append(block.travel_times[selected])
+
+    link = np.concatenate(link_parts + [np.empty(0, dtype=np.int32)])
+    hour = np.concatenate(hour_parts + [np.empty(0, dtype=np.int32)])
+    travel_time = np.concatenate(travel_time_parts + [np.empty(0, dtype=np.float32)]).astype(np.float64)
+
+    # sorted by link, hour and travel time, so every group is a sorted slice
+    order = np.lexsort((travel_time, hour, link))
+    link, hour, travel_time = link[order], hour[order], travel_time[order]
+    group_start = np.flatnonzero(np.concatenate([[len(link) > 0], (link[1:] != link[:-1]) | (hour[1:] != hour[:-1])]))
+    count = np.diff(np.append(group_start, len(link)))
+
+    result = pd.DataFrame({
+        'link': link[group_start],
+        'hour': hour[group_start],
+        'count': count,
+        'mean': np.add.reduceat(travel_time, group_start) / count if len(group_start) > 0 else np.empty(0),
+    })
+    for percentile in percentiles:
+        position = (count - 1) * percentile / 100.0
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        lower_value = travel_time[group_start + lower]
+        upper_value = travel_time[group_start + upper]
+        result['p{}'.format(percentile)] = lower_value + (upper_value - lower_value) * (position - lower)
+
+    print("calculation of travel times of {} links by hour took {} seconds"
+          .format(len(result['link'].unique()), time.time() - start_time))
+    return result
+
+
+def calc_link_travel_times_from_events(events_path, links=None, percentiles=(50, 90), chunk_filter=None):
+    """
+    travel times of links by hour (see calc_link_travel_times_by_hour) of PathTraversal events of events file,
+    only of events for which chunk_filter is true if it is specified (i.e. lambda df: df['mode'] == 'car').
+    """
+    df, csr = load_path_traversals(events_path, ['departureTime', 'mode', 'vehicleType', 'vehicle'])
+    if chunk_filter is not None:
+        selected = chunk_filter(df).values
+        df, csr = df[selected], csr.take(selected)
+    return calc_link_travel_times_by_hour(df, csr, links, percentiles)
+
+
+def build_link_lookup(link_groups):
+    """
+    names of groups of links ({name: link ids}) and lookup table from link id to the number of its group,
+    -1 for links which are not in any group
+    """
+    names = list(link_groups.keys())
+    max_link = max((max(links) for links in link_groups.values() if len(links) > 0), default=-1)
+    lookup = np.full(max_link + 1, -1, dtype=np.int32)
+    for code, name in enumerate(names):
+        lookup[np.fromiter(link_groups[name], dtype=np.int64)] = code
+    return names, lookup
+
+
+def find_link_group_crossings(df, csr, link_groups, block_size=4000000):
+    """
+    crossings of groups of links (i.e. bridges and tunnels, {name: link ids}) by PathTraversal events
+    and their links (see PathTraversalLinks): DataFrame with 'event' (position of the event in df),
+    'group' (category), 'time' and 'hour' (Int64) of entering the first link of the group,
+    they are missing if travel time of some link before it is unknown.
+    a traversal crosses a group once however many links of the group it goes through.
+    df should contain 'departureTime' column.
+    """
+    start_time = time.time()
+    df = df.reset_index(drop=True)
+    names, lookup = build_link_lookup(link_groups)
+
+    event_parts, group_parts, time_parts = [], [], []
+    for start, end in csr.get_blocks(block_size):
+        block = csr.slice(start, end)
+        codes = np.full(len(block.links), -1, dtype=np.int32)
+        in_lookup = block.links < len(lookup)
+        codes[in_lookup] = lookup[block.links[in_lookup]]
+        crossed = np.flatnonzero(codes >= 0)
+        if len(crossed) == 0:
+            continue
+        event_parts.append(block.get_event_indices()[crossed] + start)
+        group_parts.append(codes[crossed])
+        time_parts.append(get_link_entry_times(df.iloc[start:end], block)[crossed])
+
+    crossings = pd.DataFrame({
+        'event': np.concatenate(event_parts + [np.empty(0, dtype=np.int64)]),
+        'group': pd.Categorical.from_codes(np.concatenate(group_parts + [np.empty(0, dtype=np.int32)]),
+                                           categories=names),
+        'time': np.concatenate(time_parts + [np.empty(0, dtype=np.float64)]),
+    })
+    # links are in order of traversal, so the first link of a group in an event is its entering
+    crossings = crossings.drop_duplicates(['event', 'group'], ignore_index=True)
+    crossings['hour'] = (crossings['time'] // 3600).astype('Int64')
+
+    print("finding of {} crossings of {} groups of links took {} seconds"
+          .format(len(crossings), len(names), time.time() - start_time))
+    return crossings
+
+
+def count_transit_trips(pev, vehicle_types=None):
+    """
+    number of trips by every vehicle type from PersonEntersVehicle events ('person' and 'vehicleType' columns,
+    events of every person in order of time): 'unlinked_trips' is the number of boardings,
+    'linked_trips' counts consecutive boardings of one person into vehicles of the same type
+    (i.e. a subway trip with transfers) as one trip. result is indexed by vehicle type,
+    only types from vehicle_types are returned if it is specified.
+    """
+    person_codes, _ = pd.factorize(pev['person'])
+    type_codes, types = pd.factorize(pev['vehicleType'])
+
+    # stable sort keeps events of a person in order of time
+    order = np.argsort(person_codes, kind='stable')
+    person_codes, type_codes = person_codes[order], type_codes[order]
+    run_start = np.ones(len(order), dtype=bool)
+    run_start[1:] = (person_codes[1:] != person_codes[:-1]) | (type_codes[1:] != type_codes[:-1])
+
+    known = type_codes >= 0
+    trips = pd.DataFrame({
+        'unlinked_trips': np.bincount(type_codes[known], minlength=len(types)),
+        'linked_trips': np.bincount(type_codes[run_start & known], minlength=len(types)),
+    }, index=pd.Index(types, name='vehicleType'))
+    if vehicle_types is not None:
+        trips = trips.reindex(list(vehicle_types), fill_value=0)
+        trips.index.name = 'vehicleType'
+    return trips
+
+
+def calc_person_transit_distances(pte, pelv, transit_modes):
+    """
+    distance of trips of every person by every transit mode from PathTraversal events of transit vehicles
+    ('vehicle', 'departureTime', 'arrivalTime', 'length' and 'vehicleType' columns) and PersonEntersVehicle and
+    PersonLeavesVehicle events of these vehicles ('type', 'person', 'time' and 'vehicle'), both in order of time.
+    leaving of a vehicle is paired with the last entering of the same person.
+    result is indexed by sorted ids of persons with rides and has a column for every transit mode.
+    path traversals of every vehicle are numbered in order, cumulative length before every traversal is kept,
+    so distance of a ride is the difference of cumulative lengths of the traversal departed when the person
+    entered the vehicle and the first traversal arrived after the person left it.
+    """
+    # path traversals of every vehicle in order of events, vehicles are ranked
+    vehicle_codes = pte['vehicle'].values
+    order = np.argsort(vehicle_codes, kind='stable')
+    vehicle_codes = vehicle_codes[order]
+    departures = pte['departureTime'].values[order].astype(np.float64)
+    arrivals = pte['arrivalTime'].values[order].astype(np.float64)
+    vehicle_types = pte['vehicleType'].values[order]
+    cumulative_lengths = np.concatenate([[0.0], np.cumsum(pte['length'].values[order].astype(np.float64))])
+    vehicles, vehicle_ranks = np.unique(vehicle_codes, return_inverse=True)
+    vehicle_starts = np.searchsorted(vehicle_codes, vehicles)
+
+    # every leaving is paired with the last entering of the same person
+    persons = pelv['person'].values
+    person_order = np.argsort(persons, kind='stable')
+    persons = persons[person_order]
+    types = pelv['type'].values[person_order]
+    times = pelv['time'].values[person_order].astype(np.float64)
+    vehicles_of_person = pelv['vehicle'].values[person_order]
+    positions = np.arange(len(persons))
+    last_enter = np.maximum.accumulate(np.where(types == 'PersonEntersVehicle', positions, -1))
+    is_ride = (types == 'PersonLeavesVehicle') & (last_enter >= 0)
+    is_ride[is_ride] = persons[last_enter[is_ride]] == persons[is_ride]
+    other_vehicle = is_ride.copy()
+    is_ride[is_ride] = vehicles_of_person[last_enter[is_ride]] == vehicles_of_person[is_ride]
+    other_vehicle &= ~is_ride
+    if other_vehicle.any():
+        print('PROBLEMS. {} persons left different vehicle'.format(len(np.unique(persons[other_vehicle]))))
+
+    rides = np.flatnonzero(is_ride)
+    # vehicles of rides have path traversals, because events are filtered by transit vehicles
+    ride_ranks = np.searchsorted(vehicles, vehicles_of_person[rides])
+    enter_times = times[last_enter[rides]]
+    leave_times = times[rides]
+
+    # traversals are looked up by (vehicle rank, time), times are shifted to be in [0, time_span)
+    min_time = min(np.nanmin(departures, initial=0), np.nanmin(arrivals, initial=0))
+    time_span = max(np.nanmax(departures, initial=0), np.nanmax(arrivals, initial=0), np.nanmax(times, initial=0)) \
+        - min_time + 1
+    departure_keys = vehicle_ranks * time_span + (departures - min_time)
+    arrival_keys = vehicle_ranks * time_span + (arrivals - min_time)
+    # the last traversal departed at the time of entering, as in a dict of departure times
+    start = np.searchsorted(departure_keys, ride_ranks * time_span + (enter_times - min_time), side='right') - 1
+    found = start >= vehicle_starts[ride_ranks]
+    found[found] = departures[start[found]] == enter_times[found]
+    if not found.all():
+        print('PROBLEMS. {} rides entered vehicle without departure at that time'.format((~found).sum()))
+    rides, ride_ranks, start = rides[found], ride_ranks[found], start[found]
+    end = np.searchsorted(arrival_keys, ride_ranks * time_span + (times[rides] - min_time), side='right')
+    end = np.maximum(end, start)
+    distances = cumulative_lengths[end] - cumulative_lengths[start]
+
+    # vehicle type of a vehicle is the type of its first traversal
+    ride_modes = vehicle_types[vehicle_starts[ride_ranks]]
+    person_index, ride_persons = np.unique(persons[rides], return_inverse=True)
+    distances_per_mode = pd.DataFrame(index=pd.Index(person_index, name='person'))
+    for mode in transit_modes:
+        is_mode = ride_modes == mode
+        distances_per_mode[mode] = np.bincount(ride_persons[is_mode], weights=distances[is_mode],
+                                               minlength=len(person_index))
+    return distances_per_mode
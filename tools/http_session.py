@@ -0,0 +1,55 @@
+"""
+one shared HTTP session for all remote reads: keep-alive connections from a pool
+and retries with exponential backoff for failed requests.
+"""
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib.error import HTTPError
+from urllib3.util.retry import Retry
+
+retries = 5
+# sleep between retries is backoff_factor * 2 ^ (retry number - 1) seconds
+backoff_factor = 0.5
+pool_size = 32
+# seconds to wait for connection and for the next bytes of response
+timeout = (10, 120)
+
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            retry = Retry(total=retries, backoff_factor=backoff_factor,
+                          status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+
+def request(method, url, headers=None, stream=False):
+    """
+    send request through the shared session.
+    responses with error status are raised as urllib HTTPError, the same as urllib.request.urlopen does,
+    so callers could keep catching HTTPError for missing files.
+    """
+    response = get_session().request(method, url, headers=headers, stream=stream, timeout=timeout,
+                                    allow_redirects=True)
+    if response.status_code >= 400:
+        response.close()
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return response
+
+
+def get(url, headers=None, stream=False):
+    return request('GET', url, headers, stream)
+
+
+def head(url, headers=None):
+    return request('HEAD', url, headers)
@@ -7,16 +7,17 @@ import matplotlib.pyplot as plt
 import numpy as np
 import time
 import datetime as dt
-import urllib
 import pandas as pd
 import re
 
-from urllib import request
 from shapely.geometry import Point
 from shapely.geometry.polygon import Polygon
 from io import StringIO
 import statistics
 
+from .cache import cached_path, open_cached, mark_immutable
+from .aggregation import aggregate_chunks, StreamingGroupBy
+
 
 # import dashboard.ridehail_dashboard
 # import events.events
@@ -35,13 +36,21 @@ def get_output_path_from_s3_url(s3_url):
         .replace("s3.us-east-2.amazonaws.com/beam-outputs/index.html#", "beam-outputs.s3.amazonaws.com/")
 
 
+def mark_run_as_finished(s3url):
+    """
+    output files of a finished run do not change anymore,
+    so their cached copies will be used without checking for updates.
+    """
+    mark_immutable(get_output_path_from_s3_url(s3url))
+
+
 def get_realized_modes_as_str(full_path, data_file_name='referenceRealizedModeChoice.csv'):
     if data_file_name not in full_path:
         path = get_output_path_from_s3_url(full_path) + "/" + data_file_name
     else:
         path = get_output_path_from_s3_url(full_path)
 
-    df = pd.read_csv(path,
+    df = pd.read_csv(cached_path(path),
                      names=['bike', 'car', 'cav', 'drive_transit', 'ride_hail', 'ride_hail_pooled', 'ride_hail_transit',
                             'walk', 'walk_transit'])
     last_row = df.tail(1)
@@ -61,7 +70,7 @@ def get_realized_modes_as_str(full_path, data_file_name='referenceRealizedModeCh
 
 def plot_simulation_vs_google_speed_comparison(s3url, iteration, compare_vs_3am, title=""):
     s3path = get_output_path_from_s3_url(s3url)
-    google_tt = pd.read_csv(s3path + "/ITERS/it.{0}/{0}.googleTravelTimeEstimation.csv".format(iteration))
+    google_tt = pd.read_csv(cached_path(s3path + "/ITERS/it.{0}/{0}.googleTravelTimeEstimation.csv".format(iteration)))
 
     google_tt_3am = google_tt[google_tt['departureTime'] == 3 * 60 * 60].copy()
     google_tt_rest = google_tt[
@@ -172,7 +181,7 @@ def print_network_from(s3path, take_rows):
 
 
 def show_network(path, take_rows=0):
-    network_df = pd.read_csv(path)
+    network_df = pd.read_csv(cached_path(path))
     network_df = network_df[['attributeOrigType', 'linkId']]
     grouped_df = network_df.groupby(['attributeOrigType']).count()
     grouped_df.sort_values(by=['linkId'], inplace=True)
@@ -183,13 +192,13 @@ def show_network(path, take_rows=0):
 
 
 def print_file_from_url(file_url):
-    file = urllib.request.urlopen(file_url)
+    file = open_cached(file_url)
     for b_line in file.readlines():
         print(b_line.decode("utf-8"))
 
 
 def grep_beamlog(url, keywords):
-    file = urllib.request.urlopen(url)
+    file = open_cached(url)
     for b_line in file.readlines():
         line = b_line.decode("utf-8")
         for keyword in keywords:
@@ -245,7 +254,7 @@ def aggregate_per_hour(traffic_df, date):
 def plot_traffic_count(date):
     # https://data.cityofnewyork.us/Transportation/Traffic-Volume-Counts-2014-2018-/ertz-hr4r
     path_to_csv = 'https://data.cityofnewyork.us/api/views/ertz-hr4r/rows.csv?accessType=DOWNLOAD'
-    df = read_traffic_counts(pd.read_csv(path_to_csv))
+    df = read_traffic_counts(pd.read_csv(cached_path(path_to_csv)))
     agg_per_hour_df = aggregate_per_hour(df, date)
     agg_per_hour_df.plot(x='hour', y='count', title='Date is %s' % date)
 
@@ -271,7 +280,7 @@ def get_calibration_png_graphs(s3url, first_iteration=0, last_iteration=0, png_t
             ax.axes.get_xaxis().labelpad = 0
             ax.axes.get_yaxis().set_visible(False)
             ax.axes.get_yaxis().labelpad = 0
-            ax.imshow(plt.imread(path))
+            ax.imshow(plt.imread(cached_path(path)))
 
         fig, axs = plt.subplots(1, 2, figsize=(25, 10))
         fig.subplots_adjust(wspace=0.01, hspace=0.01)
@@ -299,7 +308,7 @@ def analyze_vehicle_passenger_by_hour(s3url, iteration):
 
 def plot_vehicle_type_passengets_by_hours(events_file_path, chunksize=100000):
     events = pd.concat([events[events['type'] == 'PathTraversal'] for events in
-                        pd.read_csv(events_file_path, low_memory=False, chunksize=chunksize)])
+                        pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=chunksize)])
     events['time'] = events['time'].astype('float')
     events = events.sort_values(by='time', ascending=True)
 
@@ -372,7 +381,7 @@ def people_flow_in_cbd_s3(s3url, iteration):
 
 def people_flow_in_cbd_file_path(events_file_path, chunksize=100000):
     events = pd.concat([events[events['type'] == 'PathTraversal'] for events in
-                        pd.read_csv(events_file_path, low_memory=False, chunksize=chunksize)])
+                        pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=chunksize)])
     return people_flow_in_cdb(events)
 
 
@@ -386,9 +395,9 @@ def diff_people_flow_in_cbd_s3(s3url, iteration, s3url_base, iteration_base):
 
 def diff_people_flow_in_cbd_file_path(events_file_path, events_file_path_base, chunksize=100000):
     events = pd.concat([events[events['type'] == 'PathTraversal'] for events in
-                        pd.read_csv(events_file_path, low_memory=False, chunksize=chunksize)])
+                        pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=chunksize)])
     events_base = pd.concat([events[events['type'] == 'PathTraversal'] for events in
-                             pd.read_csv(events_file_path_base, low_memory=False, chunksize=chunksize)])
+                             pd.read_csv(cached_path(events_file_path_base), low_memory=False, chunksize=chunksize)])
     return diff_people_in(events, events_base)
 
 
@@ -536,7 +545,7 @@ def plot_hists(df, column_group_by, column_build_hist, ax, bins=100, alpha=0.2):
 
 def calc_number_of_rows_in_beamlog(s3url, keyword):
     s3path = get_output_path_from_s3_url(s3url)
-    beamlog = urllib.request.urlopen(s3path + "/beamLog.out")
+    beamlog = open_cached(s3path + "/beamLog.out")
     count = 0
     for b_line in beamlog.readlines():
         line = b_line.decode("utf-8")
@@ -568,7 +577,7 @@ def grep_beamlog_for_errors_warnings(s3url):
     print("")
 
     s3path = get_output_path_from_s3_url(s3url)
-    file = urllib.request.urlopen(s3path + "/beamLog.out")
+    file = open_cached(s3path + "/beamLog.out")
     for b_line in file.readlines():
         line = b_line.decode("utf-8")
 
@@ -596,7 +605,7 @@ def grep_beamlog_for_errors_warnings(s3url):
 def get_default_and_emergency_parkings(s3url, iteration):
     s3path = get_output_path_from_s3_url(s3url)
     parking_file_path = s3path + "/ITERS/it.{0}/{0}.parkingStats.csv".format(iteration)
-    parking_df = pd.read_csv(parking_file_path)
+    parking_df = pd.read_csv(cached_path(parking_file_path))
     parking_df['TAZ'] = parking_df['TAZ'].astype(str)
     filtered_df = parking_df[
         (parking_df['TAZ'].str.contains('default')) | (parking_df['TAZ'].str.contains('emergency'))]
@@ -608,7 +617,8 @@ def get_default_and_emergency_parkings(s3url, iteration):
 def load_modechoices(events_file_path, chunksize=100000):
     start_time = time.time()
     df = pd.concat(
-        [df[df['type'] == 'ModeChoice'] for df in pd.read_csv(events_file_path, low_memory=False, chunksize=chunksize)])
+        [df[df['type'] == 'ModeChoice']
+         for df in pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=chunksize)])
     print("events file url:", events_file_path)
     print("modechoice loading took %s seconds" % (time.time() - start_time))
     return df
@@ -621,7 +631,7 @@ def analyze_mode_choice_changes(title_to_s3url, benchmark_url):
                  'ride_hail_pooled', 'ride_hail_transit', 'walk', 'walk_transit']
 
         path = get_output_path_from_s3_url(s3url) + "/" + data_file_name
-        df = pd.read_csv(path, names=modes)
+        df = pd.read_csv(cached_path(path), names=modes)
         tail = df.tail(1).copy()
 
         for mode in modes:
@@ -673,7 +683,7 @@ def load_activities(events_file_path, chunksize=100000):
     start_time = time.time()
     df = pd.concat(
         [df[(df['type'] == 'actstart') | (df['type'] == 'actend')] for df in
-         pd.read_csv(events_file_path, low_memory=False, chunksize=chunksize)])
+         pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=chunksize)])
     df['hour'] = (df['time'] / 3600).astype(int)
     print("events file url:", events_file_path)
     print("actstart and actend events loading took %s seconds" % (time.time() - start_time))
@@ -686,7 +696,7 @@ def plot_modechoice_distance_distribution(s3url, iteration):
 
     start_time = time.time()
     events_file = pd.concat([df[df['type'] == 'ModeChoice']
-                             for df in pd.read_csv(events_file_path, low_memory=False, chunksize=100000)])
+                             for df in pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=100000)])
     print("modechoice loading took %s seconds" % (time.time() - start_time))
 
     events_file['length'].hist(bins=100, by=events_file['mode'], figsize=(20, 12), rot=10, sharex=True)
@@ -694,7 +704,7 @@ def plot_modechoice_distance_distribution(s3url, iteration):
 
 def get_average_car_speed(s3url, iteration):
     s3path = get_output_path_from_s3_url(s3url)
-    average_speed = pd.read_csv(s3path + "/AverageCarSpeed.csv")
+    average_speed = pd.read_csv(cached_path(s3path + "/AverageCarSpeed.csv"))
     return average_speed[average_speed['iteration'] == iteration]['speed'].median()
 
 
@@ -705,16 +715,26 @@ def plot_simulation_volumes_vs_bench(s3url, iteration, ax, title="Volume SUM com
 
     def calc_sum_of_link_stats(link_stats_file_path, chunksize=100000):
         start_time = time.time()
-        df = pd.concat([df.groupby('hour')['volume'].sum() for df in
-                        pd.read_csv(link_stats_file_path, low_memory=False, chunksize=chunksize)])
-        df = df.groupby('hour').sum().to_frame(name='sum')
+        df = aggregate_chunks(pd.read_csv(open_cached(link_stats_file_path), compression='gzip', low_memory=False,
+                                          chunksize=chunksize), 'hour', {'sum': ('volume', 'sum')})
         # print("link stats url:", link_stats_file_path)
         print("link stats downloading and calculation took %s seconds" % (time.time() - start_time))
         return df
 
+    def calc_sum_of_car_volumes(events_file_path):
+        from .events import calc_link_volumes_from_events
+        link_volumes = calc_link_volumes_from_events(events_file_path, chunk_filter=lambda df: df['mode'] == 'car')
+        return link_volumes.groupby('hour')['volume'].sum().to_frame(name='sum')
+
     if simulation_volumes is None:
         linkstats_path = s3path + "/ITERS/it.{0}/{0}.linkstats.csv.gz".format(iteration)
-        simulation_volumes = calc_sum_of_link_stats(linkstats_path)
+        try:
+            simulation_volumes = calc_sum_of_link_stats(linkstats_path)
+        except HTTPError:
+            # linkstats are not written for every iteration, car volumes are calculated from events then
+            print("there is no link stats for iteration {}, volumes are calculated from events".format(iteration))
+            events_path = s3path + "/ITERS/it.{0}/{0}.events.csv.gz".format(iteration)
+            simulation_volumes = calc_sum_of_car_volumes(events_path)
 
     color_benchmark = 'tab:red'
     color_volume = 'tab:green'
@@ -752,7 +772,8 @@ def plot_activities_ends_vs_bench(s3url, iteration, ax, ax2=None, title="Activit
         start_time = time.time()
         try:
             df = pd.concat([df[df['type'] == 'actend']
-                            for df in pd.read_csv(events_file_path, low_memory=False, chunksize=chunksize)])
+                            for df in
+                            pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=chunksize)])
         except HTTPError:
             raise NameError('can not download file by url:', events_file_path)
         df['hour'] = (df['time'] / 3600).astype(int)
@@ -900,7 +921,7 @@ def analyze_fake_walkers(s3url, iteration, threshold=2000, title="", modechoice=
 
 
 def parse_config(config_url, complain=True):
-    config = urllib.request.urlopen(config_url)
+    config = open_cached(config_url)
 
     config_keys = ["flowCapacityFactor", "speedScalingFactor", "quick_fix_minCarSpeedInMetersPerSecond",
                    "activitySimEnabled", "transitCapacity",
@@ -1015,20 +1036,18 @@ def calculate_median_time_at_home(s3url, iteration, total_persons, debug_print=F
     s3path = get_output_path_from_s3_url(s3url)
     events_file_path = s3path + "/ITERS/it.{0}/{0}.events.csv.gz".format(iteration)
 
-    home_acts = pd.concat([events[events['actType'] == 'Home']
-                           for events in pd.read_csv(events_file_path, low_memory=False, chunksize=10000)])
-
-    def get_home_activity_time(row):
-        if row['type'] == 'actend':
-            return min(row['time'] / 3600, 24.0)
-        if row['type'] == 'actstart':
-            return max(row['time'] / -3600, -23.9)
-        return 0
+    # only sum of home activity time per person is kept, not the home activities themselves
+    home_time = StreamingGroupBy('person', {'homeActTime': ('homeActTime', 'sum')})
+    for events in pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=100000):
+        home_acts = events[events['actType'] == 'Home']
+        # actend adds hours since midnight, actstart subtracts them
+        home_acts = home_acts.assign(homeActTime=np.select(
+            [home_acts['type'] == 'actend', home_acts['type'] == 'actstart'],
+            [np.minimum(home_acts['time'] / 3600, 24.0), np.maximum(home_acts['time'] / -3600, -23.9)], 0))
+        home_time.update(home_acts)
+    home_activities = (home_time.result()['homeActTime'] + 24).reset_index()
 
-    home_acts['homeActTime'] = home_acts.apply(get_home_activity_time, axis=1)
-    home_activities = ((home_acts.groupby('person')['homeActTime']).sum() + 24).reset_index()
-
-    affected_persons = len(home_acts['person'].unique())
+    affected_persons = len(home_activities)
 
     all_people_home_time = list(home_activities['homeActTime']) + [24] * (total_persons - affected_persons)
     median_time_at_home = statistics.median(all_people_home_time)
@@ -1120,7 +1139,7 @@ def compare_riderships_vs_baserun_and_benchmark(title_to_s3url, iteration, s3url
         def read_csv(filename):
             file_url = s3path + "/ITERS/it.{0}/{0}.{1}.csv".format(iteration, filename)
             try:
-                return pd.read_csv(file_url)
+                return pd.read_csv(cached_path(file_url))
             except HTTPError:
                 print('was not able to download', file_url)
 
@@ -1197,7 +1216,7 @@ def plot_modechoice_comparison(title_to_s3url, benchmark_url, benchmark_name="be
 
     def get_realized_modes(s3url, data_file_name='realizedModeChoice.csv', fake_walkers_dict=None):
         path = get_output_path_from_s3_url(s3url) + "/" + data_file_name
-        df = pd.read_csv(path)
+        df = pd.read_csv(cached_path(path))
         tail = df.tail(1).copy()
 
         exist_columns = set(tail.columns)
@@ -1285,7 +1304,7 @@ def plot_modechoice_comparison(title_to_s3url, benchmark_url, benchmark_name="be
 
 
 def load_mapping():
-    return pd.read_csv("https://github.com/LBNL-UCB-STI/beam/files/5146939/beam_transcom_mapping.csv.gz")
+    return pd.read_csv(cached_path("https://github.com/LBNL-UCB-STI/beam/files/5146939/beam_transcom_mapping.csv.gz"))
 
 
 def load_tmc_dictionary():
@@ -1294,7 +1313,8 @@ def load_tmc_dictionary():
     tmc_path = "https://beam-outputs.s3.amazonaws.com/new_city/newyork/DOT_Traffic_Speeds_20200301.csv.gz"
     tmc_df = pd.concat([df[df['LINK_ID'].isin(mapping['trafLink'])]
                         for df in
-                        pd.read_csv(tmc_path, low_memory=False, chunksize=100000, parse_dates=['DATA_AS_OF'])])
+                        pd.read_csv(cached_path(tmc_path), low_memory=False, chunksize=100000,
+                                    parse_dates=['DATA_AS_OF'])])
     wed = tmc_df[(tmc_df['DATA_AS_OF'].dt.dayofweek == 2)].copy()
 
     def group_speed_by_hour(tmc_original):
@@ -1307,12 +1327,34 @@ def load_tmc_dictionary():
     return {month: group_speed_by_hour(wed[wed['DATA_AS_OF'].dt.month == month]) for month in months}
 
 
-def plot_link_graphs(tmc_data, s3url, iteration, ax=None, plot_transcom=True):
+def load_link_stats_from_events(s3path, iteration, links):
+    """
+    linkstats-like table ('link', 'hour', 'length', 'traveltime', 'volume') of links
+    calculated from car PathTraversal events, link lengths are taken from the network of the run
+    """
+    from .events import calc_link_travel_times_from_events
+
+    events_path = f"{s3path}/ITERS/it.{iteration}/{iteration}.events.csv.gz"
+    travel_times = calc_link_travel_times_from_events(events_path, links, percentiles=(),
+                                                      chunk_filter=lambda df: df['mode'] == 'car')
+    network = pd.read_csv(cached_path(s3path + '/network.csv.gz'), usecols=['linkId', 'linkLength'])
+    ls = travel_times.rename(columns={'mean': 'traveltime', 'count': 'volume'})
+    return ls.merge(network.rename(columns={'linkId': 'link', 'linkLength': 'length'}), on='link')
+
+
+def plot_link_graphs(tmc_data, s3url, iteration, ax=None, plot_transcom=True, from_events=False):
+    """
+    speed on links mapped to TRANSCOM links by hour, from linkstats or from events if from_events is True
+    """
     mapping = load_mapping()
 
     s3path = get_output_path_from_s3_url(s3url)
-    linkstats_path = f"{s3path}/ITERS/it.{iteration}/{iteration}.linkstats.csv.gz"
-    ls = pd.concat([df[df['link'].isin(mapping['beamLink'])] for df in pd.read_csv(linkstats_path, chunksize=100000)])
+    if from_events:
+        ls = load_link_stats_from_events(s3path, iteration, mapping['beamLink'])
+    else:
+        linkstats_path = f"{s3path}/ITERS/it.{iteration}/{iteration}.linkstats.csv.gz"
+        ls = pd.concat([df[df['link'].isin(mapping['beamLink'])]
+                        for df in pd.read_csv(open_cached(linkstats_path), compression='gzip', chunksize=100000)])
 
     ms_to_mph = 2.23694
     ls['speed'] = ms_to_mph * ls['length'] / ls['traveltime']
@@ -1380,92 +1422,102 @@ def plot_calibration_parameters(title_to_s3url,
                  color=removal_probabilities_color, alpha=0.5, linewidth=linewidth)
 
 
-def read_nyc_ridership_counts_absolute_numbers_for_mta_comparison(s3url, iteration=0):
-    holland_tunnel = {1110292, 1110293, 1110294, 1110295, 540918, 540919, 782080, 782081}
-    linkoln_tunnel = {1057628, 1057629, 1057630, 1057631, 308, 309, 817812, 817813, 817814, 817815, 87180, 87181}
-    george_washingtone_bridge = {735454, 735455, 767820, 767821, 781014, 781015, 781086, 781087, 781156, 781157, 782128,
+# links of MTA bridges and tunnels, by facility
+mta_bridges_tunnels = {
+    'Holland Tunnel': {1110292, 1110293, 1110294, 1110295, 540918, 540919, 782080, 782081},
+    'Lincoln Tunnel': {1057628, 1057629, 1057630, 1057631, 308, 309, 817812, 817813, 817814, 817815, 87180, 87181},
+    'George Washington Bridge': {735454, 735455, 767820, 767821, 781014, 781015, 781086, 781087, 781156, 781157, 782128,
                                  782129, 796856, 796857, 796858, 796859, 796870, 796871, 866324, 866325, 87174, 87175,
-                                 87176, 87177, 88110, 88111, 886008, 886009, 968272, 968273, 781094, 781095}
-    henry_hudson_bridge = {1681043, 1681042, 542015, 542014, 88230, 88231}
-    robert_f_kennedy_bridge = {1235912, 1235913, 1247588, 1247589, 21094, 21095, 23616, 23617, 29774, 29775, 30814,
-                               30815, 763932, 763933, 782436, 782437, 782438, 782439, 782440, 782441, 782560, 782561,
-                               782570, 782571, 782702, 782703, 782706, 782707, 782708, 782709, 782718, 782719, 870348,
-                               870349, 782720, 782721, 782722, 782723, 782724, 782725, 782726, 782727, 782728, 782729,
-                               782914, 782915, 853900, 853901, 1230075, 1233314, 1233315, 1299262, 1299263, 1299264,
-                               1299265, 1299266, 1299267, 1299268, 1299269, 1299274, 1299275, 1299278, 1299279, 958834,
-                               958835, 958836, 958837, 916655, 1041132, 1041133, 1078046, 1078047, 1078048, 1078049,
-                               1078050, 1078051, 1078052, 1078053, 1078056, 1078057, 1078058, 1078059, 1078060, 1078061,
-                               1089632, 1089633, 1089634, 1089635, 1101864, 1101865, 1101866, 1101867, 1230068, 1230069,
-                               1230070, 1230071, 1230072, 1230073, 1230074, 916652, 916653, 916654, 757589, 757588,
-                               853929, 853928, 779898, 779899, 1339888, 1339889, 1339890, 1339891, 1433020, 1433021,
-                               154, 155, 731748, 731749, 731752, 731753, 731754, 731755, 731766, 731767, 731768, 731769,
-                               731770, 731771, 731786, 731787, 853892, 853893, 868400, 868401, 868410, 868411}
-    queens_midtown_tunnel = {1367889, 1367888, 487778, 487779}
-    hugh_l_carey_tunnel = {1071576, 1071577, 1109400, 1109401, 13722, 13723, 1658828, 1658829, 19836, 19837}
-    bronx_whitestone_bridge = {62416, 62417, 729848, 729849, 765882, 765883, 853914, 853915}
-    throgs_neck_bridge = {1090614, 1090615, 1090616, 1090617, 1090618, 1090619, 765880, 765881}
-    varrazzano_narrows_bridge = {788119, 788118, 1341065, 1341064, 788122, 788123, 788140, 788141}
-    marine_parkwaygil_hodges_memorial_bridge = {1750240, 1750241, 53416, 53417, 732358, 732359, 761184, 761185, 761186,
-                                                761187, 793744, 793745}
-    cross_bay_veterans_memorial_bridge = {1139186, 1139187, 1139198, 1139199, 1139200, 1139201, 1139208, 1139209,
-                                          1139214, 1139215, 1139222, 1139223, 1139300, 1139301, 1139302, 1139303,
-                                          1517804, 1517805, 1517806, 1517807, 1517808, 1517809, 1743514, 1743515,
-                                          1749330, 1749331, 1749332, 1749333, 48132, 48133, 51618, 51619, 51620, 51621,
-                                          59452, 59453, 68364, 68365, 793786, 793787, 865036, 865037, 865060, 865061,
-                                          865062, 865063, 953766, 953767, 953768, 953769, 999610, 999611, 999626,
-                                          999627, 999628, 999629, 1297379}
-
-    mta_briges_tunnels_links = holland_tunnel \
-        .union(linkoln_tunnel) \
-        .union(george_washingtone_bridge) \
-        .union(henry_hudson_bridge) \
-        .union(robert_f_kennedy_bridge) \
-        .union(queens_midtown_tunnel) \
-        .union(hugh_l_carey_tunnel) \
-        .union(bronx_whitestone_bridge) \
-        .union(throgs_neck_bridge) \
-        .union(varrazzano_narrows_bridge) \
-        .union(marine_parkwaygil_hodges_memorial_bridge) \
-        .union(cross_bay_veterans_memorial_bridge)
+                                 87176, 87177, 88110, 88111, 886008, 886009, 968272, 968273, 781094, 781095},
+    'Henry Hudson Bridge': {1681043, 1681042, 542015, 542014, 88230, 88231},
+    'Robert F. Kennedy Bridge': {1235912, 1235913, 1247588, 1247589, 21094, 21095, 23616, 23617, 29774, 29775, 30814,
+                                 30815, 763932, 763933, 782436, 782437, 782438, 782439, 782440, 782441, 782560, 782561,
+                                 782570, 782571, 782702, 782703, 782706, 782707, 782708, 782709, 782718, 782719, 870348,
+                                 870349, 782720, 782721, 782722, 782723, 782724, 782725, 782726, 782727, 782728, 782729,
+                                 782914, 782915, 853900, 853901, 1230075, 1233314, 1233315, 1299262, 1299263, 1299264,
+                                 1299265, 1299266, 1299267, 1299268, 1299269, 1299274, 1299275, 1299278, 1299279,
+                                 958834, 958835, 958836, 958837, 916655, 1041132, 1041133, 1078046, 1078047, 1078048,
+                                 1078049, 1078050, 1078051, 1078052, 1078053, 1078056, 1078057, 1078058, 1078059,
+                                 1078060, 1078061, 1089632, 1089633, 1089634, 1089635, 1101864, 1101865, 1101866,
+                                 1101867, 1230068, 1230069, 1230070, 1230071, 1230072, 1230073, 1230074, 916652, 916653,
+                                 916654, 757589, 757588, 853929, 853928, 779898, 779899, 1339888, 1339889, 1339890,
+                                 1339891, 1433020, 1433021, 154, 155, 731748, 731749, 731752, 731753, 731754, 731755,
+                                 731766, 731767, 731768, 731769, 731770, 731771, 731786, 731787, 853892, 853893, 868400,
+                                 868401, 868410, 868411},
+    'Queens Midtown Tunnel': {1367889, 1367888, 487778, 487779},
+    'Hugh L. Carey Tunnel': {1071576, 1071577, 1109400, 1109401, 13722, 13723, 1658828, 1658829, 19836, 19837},
+    'Bronx-Whitestone Bridge': {62416, 62417, 729848, 729849, 765882, 765883, 853914, 853915},
+    'Throgs Neck Bridge': {1090614, 1090615, 1090616, 1090617, 1090618, 1090619, 765880, 765881},
+    'Verrazzano-Narrows Bridge': {788119, 788118, 1341065, 1341064, 788122, 788123, 788140, 788141},
+    'Marine Parkway-Gil Hodges Memorial Bridge': {1750240, 1750241, 53416, 53417, 732358, 732359, 761184, 761185,
+                                                  761186, 761187, 793744, 793745},
+    'Cross Bay Veterans Memorial Bridge': {1139186, 1139187, 1139198, 1139199, 1139200, 1139201, 1139208, 1139209,
+                                           1139214, 1139215, 1139222, 1139223, 1139300, 1139301, 1139302, 1139303,
+                                           1517804, 1517805, 1517806, 1517807, 1517808, 1517809, 1743514, 1743515,
+                                           1749330, 1749331, 1749332, 1749333, 48132, 48133, 51618, 51619, 51620, 51621,
+                                           59452, 59453, 68364, 68365, 793786, 793787, 865036, 865037, 865060, 865061,
+                                           865062, 865063, 953766, 953767, 953768, 953769, 999610, 999611, 999626,
+                                           999627, 999628, 999629, 1297379},
+}
+
+
+def find_mta_bridges_tunnels_crossings(path_traversals):
+    """
+    crossings of MTA bridges and tunnels by PathTraversal events with 'links', 'linkTravelTime' and 'departureTime'
+    columns (see events.find_link_group_crossings), 'event' is the position of the event in path_traversals
+    """
+    from .events import PathTraversalLinks, find_link_group_crossings
+    csr = PathTraversalLinks.from_events(path_traversals)
+    return find_link_group_crossings(path_traversals, csr, mta_bridges_tunnels)
 
-    s3path = get_output_path_from_s3_url(s3url)
 
-    events_file_path = "{0}/ITERS/it.{1}/{1}.events.csv.gz".format(s3path, iteration)
-    columns = ['type', 'person', 'vehicle', 'vehicleType', 'links', 'time', 'driver']
-    pte = pd.concat([df[(df['type'] == 'PersonEntersVehicle') | (df['type'] == 'PathTraversal')][columns]
-                     for df in pd.read_csv(events_file_path, chunksize=100000, low_memory=False)])
+def read_mta_bridges_tunnels_crossings_by_hour(s3url, iteration=0, vehicle_types=None):
+    """
+    number of crossings of every MTA bridge and tunnel (columns) by hour of crossing (index)
+    by vehicles of vehicle_types (cars by default).
+    crossings with unknown time (travel times of the traversal are missing) are counted in the <NA> hour.
+    """
+    if vehicle_types is None:
+        vehicle_types = {'Car', 'Car-rh-only', 'PHEV', 'BUS-DEFAULT'}
 
-    print('read pev and pt events of shape:', pte.shape)
+    from .events import load_events_from_s3_chunked
 
-    pev = pte[(pte['type'] == 'PersonEntersVehicle')][['type', 'person', 'vehicle', 'time']]
-    pte = pte[(pte['type'] == 'PathTraversal')][['type', 'vehicle', 'vehicleType', 'links', 'time', 'driver']]
+    def chunk_filter(df):
+        return (df['type'] == 'PathTraversal') & df['vehicleType'].isin(vehicle_types)
 
-    walk_transit_modes = {'BUS-DEFAULT', 'RAIL-DEFAULT', 'SUBWAY-DEFAULT'}
-    drivers = set(pte[pte['vehicleType'].isin(walk_transit_modes)]['driver'])
-    pev = pev[~pev['person'].isin(drivers)]
+    columns = ['vehicleType', 'links', 'linkTravelTime', 'departureTime']
+    pte = load_events_from_s3_chunked(s3url, iteration, chunk_filter, event_types=['PathTraversal'],
+                                      columns=['type'] + columns)[columns]
+    crossings = find_mta_bridges_tunnels_crossings(pte)
+    return crossings.groupby(['hour', 'group'], observed=False, dropna=False).size().unstack('group', fill_value=0)
 
-    def get_gtfs_agency(row):
-        veh_id = row['vehicle'].split(":")
-        if len(veh_id) > 1:
-            agency = veh_id[0]
-            return agency
-        return ""
 
-    def car_by_mta_bridges_tunnels(row):
-        if pd.isnull(row['links']):
-            return False
+def read_nyc_ridership_counts_absolute_numbers_for_mta_comparison(s3url, iteration=0):
+    from .events import load_events_from_s3_chunked, IdDictionary, count_transit_trips
 
-        for link_str in row['links'].split(","):
-            link = int(link_str)
-            if link in mta_briges_tunnels_links:
-                return True
+    # person and vehicle ids are int32 codes, so joins and group-bys below are integer operations
+    ids = IdDictionary()
+    event_types = ['PersonEntersVehicle', 'PathTraversal']
+    columns = ['type', 'person', 'vehicle', 'vehicleType', 'links', 'linkTravelTime', 'time', 'departureTime',
+               'driver']
+    pte = load_events_from_s3_chunked(s3url, iteration, lambda df: df['type'].isin(event_types),
+                                      event_types=event_types, columns=columns, id_dictionary=ids)[columns]
+    pte = pte.astype({'type': object, 'vehicleType': object})
 
-        return False
+    print('read pev and pt events of shape:', pte.shape)
+
+    pev = pte[(pte['type'] == 'PersonEntersVehicle')][['type', 'person', 'vehicle', 'time']]
+    pte = pte[(pte['type'] == 'PathTraversal')][['type', 'vehicle', 'vehicleType', 'links', 'linkTravelTime', 'time',
+                                                 'departureTime', 'driver']]
 
-    pte['carMtaRelated'] = pte.apply(car_by_mta_bridges_tunnels, axis=1)
-    pte['gtfsAgency'] = pte.apply(get_gtfs_agency, axis=1)
+    walk_transit_modes = {'BUS-DEFAULT', 'RAIL-DEFAULT', 'SUBWAY-DEFAULT'}
+    drivers = set(pte[pte['vehicleType'].isin(walk_transit_modes)]['driver'])
+    pev = pev[~pev['person'].isin(drivers)]
 
-    vehicle_info = pte.groupby('vehicle')[['vehicleType', 'gtfsAgency']].first().reset_index()
+    vehicle_info = pte.groupby('vehicle')[['vehicleType']].first().reset_index()
+    # agency of transit vehicle is the part of its id before ':', empty for other vehicles
+    vehicle_ids = pd.Series(ids.decode(vehicle_info['vehicle']), dtype=object)
+    vehicle_info['gtfsAgency'] = vehicle_ids.str.extract(r'^([^:]*):', expand=False).fillna('').values
 
     pev_advanced = pd.merge(pev, vehicle_info, on='vehicle')
     pev_advanced = pev_advanced.sort_values('time', ignore_index=True)
@@ -1474,33 +1526,19 @@ def read_nyc_ridership_counts_absolute_numbers_for_mta_comparison(s3url, iterati
 
     # calculate car
     car_mode = {'Car', 'Car-rh-only', 'PHEV', 'BUS-DEFAULT'}
-    car_mta_related = pte[(pte['vehicleType'].isin(car_mode)) &
-                          (pte['carMtaRelated'])]['time'].count()
-    transit_car_to_count = gtfs_agency_to_count.append(pd.Series([car_mta_related], index=['Car']))
-
-    # calculate subway
-    person_pevs = pev_advanced.groupby('person').agg(list)[['vehicleType', 'gtfsAgency']]
-
-    def calc_number_of_subway_trips(row):
-        vehicle_list = row['vehicleType']
-        count_of_trips = 0
-        last_was_subway = False
-        for vehicle in vehicle_list:
-            if vehicle == 'SUBWAY-DEFAULT':
-                if not last_was_subway:
-                    count_of_trips = count_of_trips + 1
-                    last_was_subway = True
-            else:
-                last_was_subway = False
-        return count_of_trips
+    car_crossings = find_mta_bridges_tunnels_crossings(pte[pte['vehicleType'].isin(car_mode)])
+    print('crossings of MTA bridges and tunnels:\n', car_crossings.groupby('group', observed=False).size())
+    car_mta_related = car_crossings['event'].nunique()
+    transit_car_to_count = pd.concat([gtfs_agency_to_count, pd.Series([car_mta_related], index=['Car'])])
 
-    person_pevs['subway_trips'] = person_pevs.apply(calc_number_of_subway_trips, axis=1)
-    subway_trips = person_pevs['subway_trips'].sum()
+    # calculate subway, a trip with transfers between subway vehicles is one trip
+    transit_trips = count_transit_trips(pev_advanced)
+    subway_trips = transit_trips['linked_trips'].get('SUBWAY-DEFAULT', 0)
 
-    triptype_to_count = transit_car_to_count.append(pd.Series([subway_trips], index=['Subway']))
+    triptype_to_count = pd.concat([transit_car_to_count, pd.Series([subway_trips], index=['Subway'])])
     triptype_to_count = triptype_to_count.to_frame().reset_index()
 
-    print('calculated:\n', pev_advanced.groupby('vehicleType')['person'].count())
+    print('calculated:\n', transit_trips.sort_index())
 
     return triptype_to_count
 
@@ -1545,7 +1583,7 @@ def calculate_nyc_ridership_and_save_to_s3_if_not_calculated(s3url, iteration, a
             ridership = calculate()
         else:
             try:
-                ridership = pd.read_csv(path, low_memory=False)
+                ridership = pd.read_csv(cached_path(path), low_memory=False)
                 print("file exist with path '{}'".format(path))
             except HTTPError:
                 print("Looks like file does not exits with path '{}'".format(path))
@@ -1568,7 +1606,7 @@ def read_ridership_from_s3_output(s3url, iteration):
         path = "{}/{}/{}".format(s3path, s3_additional_output, ridership_file_name)
 
         try:
-            ridership = pd.read_csv(path, low_memory=False)
+            ridership = pd.read_csv(cached_path(path), low_memory=False)
             print("downloaded ridership from ", path)
         except HTTPError:
             print("Looks like file does not exits -> '{}'".format(path))
@@ -1652,7 +1690,7 @@ def read_nyc_gtfs_trip_id_to_route_id():
     trip_id_to_route_id = {}
 
     for url in urls:
-        trips = pd.read_csv(url.strip(), low_memory=False)[['route_id', 'trip_id']]
+        trips = pd.read_csv(cached_path(url.strip()), low_memory=False)[['route_id', 'trip_id']]
         for index, row in trips.iterrows():
             trip_id_to_route_id[str(row['trip_id'])] = row['route_id']
         print(len(trip_id_to_route_id))
@@ -1669,7 +1707,7 @@ def read_bus_ridership_by_route_and_hour(s3url, gtfs_trip_id_to_route_id=None, i
     events_file_path = "{0}/ITERS/it.{1}/{1}.events.csv.gz".format(s3path, iteration)
     columns = ['type', 'person', 'vehicle', 'vehicleType', 'time', 'driver']
     pte = pd.concat([df[(df['type'] == 'PersonEntersVehicle') | (df['type'] == 'PathTraversal')][columns]
-                     for df in pd.read_csv(events_file_path, chunksize=100000, low_memory=False)])
+                     for df in pd.read_csv(cached_path(events_file_path), chunksize=100000, low_memory=False)])
 
     print('read PEV and PT events of shape:', pte.shape)
 
@@ -1716,17 +1754,19 @@ def read_bus_ridership_by_route_and_hour(s3url, gtfs_trip_id_to_route_id=None, i
 
 
 def read_persons_vehicles_trips(s3url, iteration):
-    def read_pte_pelv_for_walk_transit(nrows=None):
-        s3path = get_output_path_from_s3_url(s3url)
-        events_file_path = s3path + "/ITERS/it.{0}/{0}.events.csv.gz".format(iteration)
+    from .events import load_events_from_s3_chunked, IdDictionary, calc_person_transit_distances
+
+    # person and vehicle ids are int32 codes while trips are calculated, they are decoded back in the result
+    ids = IdDictionary()
 
+    def read_pte_pelv_for_walk_transit():
         start_time = time.time()
+        event_types = ['PersonEntersVehicle', 'PathTraversal', 'PersonLeavesVehicle']
         columns = ['type', 'time', 'vehicle', 'driver', 'arrivalTime', 'departureTime', 'length', 'vehicleType',
                    'person']
-        events = pd.concat([df[(df['type'] == 'PersonEntersVehicle') |
-                               (df['type'] == 'PathTraversal') |
-                               (df['type'] == 'PersonLeavesVehicle')][columns]
-                            for df in pd.read_csv(events_file_path, low_memory=False, chunksize=100000, nrows=nrows)])
+        events = load_events_from_s3_chunked(s3url, iteration, lambda df: df['type'].isin(event_types),
+                                             event_types=event_types, columns=columns, id_dictionary=ids)[columns]
+        events = events.astype({'type': object, 'vehicleType': object})
         print("events loading took %s seconds" % (time.time() - start_time))
 
         ptes = events[events['type'] == 'PathTraversal']
@@ -1753,59 +1793,20 @@ def read_persons_vehicles_trips(s3url, iteration):
     person_trips = pelv.groupby('person')[['type', 'time', 'vehicle']].agg(list).copy()
     print('person_trips:', person_trips.shape)
 
-    def get_dict_departure_to_index(row):
-        depart = row['departureTime']
-        return {x: i for x, i in zip(depart, range(len(depart)))}
-
     vehicles_trips = pte.groupby('vehicle')[['arrivalTime', 'departureTime', 'length', 'vehicleType']].agg(list).copy()
-    vehicles_trips['departureToIndex'] = vehicles_trips.apply(get_dict_departure_to_index, axis=1)
     print('vehicles_trips:', vehicles_trips.shape)
 
-    def calc_person_trips_distances(row, transit_modes, vehicles_trips_df):
-        ttypes = row['type']
-        ttimes = row['time']
-        tvehicles = row['vehicle']
-
-        veh_entered = None
-        time_entered = None
-        trips_per_mode = {x: 0.0 for x in transit_modes}
-
-        if len(ttypes) != len(ttimes) or len(ttypes) != len(tvehicles):
-            print('PROBLEMS. lengts are not equal:', row)
-            return [trips_per_mode[tm] for tm in transit_modes]
-
-        for (ttype, ttime, tvehicle) in zip(ttypes, ttimes, tvehicles):
-            if ttype == 'PersonEntersVehicle':
-                veh_entered = tvehicle
-                time_entered = ttime
-
-            if ttype == 'PersonLeavesVehicle':
-                if veh_entered is None:
-                    pass
-                elif veh_entered != tvehicle:
-                    print('PROBLEMS. left different vehicle:', row)
-                else:
-                    veh_trip = vehicles_trips_df.loc[tvehicle]
-                    veh_type = veh_trip['vehicleType'][0]
-                    arrivals = veh_trip['arrivalTime']
-                    lenghts = veh_trip['length']
-                    idx = veh_trip['departureToIndex'].get(time_entered)
-                    trip_len = 0
-
-                    while len(arrivals) > idx and arrivals[idx] <= ttime:
-                        trip_len = trip_len + lenghts[idx]
-                        idx = idx + 1
-
-                    trips_per_mode[veh_type] = trips_per_mode[veh_type] + trip_len
-
-        return [trips_per_mode[tm] for tm in transit_modes]
-
     transit_modes_names = list(walk_transit_modes)
 
-    person_trips[transit_modes_names] = person_trips.apply(
-        lambda row: calc_person_trips_distances(row, transit_modes_names, vehicles_trips), axis=1, result_type="expand")
+    distances = calc_person_transit_distances(pte, pelv, transit_modes_names)
+    person_trips[transit_modes_names] = distances.reindex(person_trips.index, fill_value=0.0)
+
+    person_trips.index = pd.Index(ids.decode(person_trips.index), name='person')
+    person_trips['vehicle'] = [list(ids.decode(vehicles)) for vehicles in person_trips['vehicle']]
+    vehicles_trips.index = pd.Index(ids.decode(vehicles_trips.index), name='vehicle')
 
-    return person_trips, vehicles_trips
+    # groups are in order of int codes, the result is sorted by ids as it is grouped by string ids
+    return person_trips.sort_index(), vehicles_trips.sort_index()
 
 
 def get_from_s3(s3url, file_name,
@@ -1814,7 +1815,7 @@ def get_from_s3(s3url, file_name,
     path = "{}/{}/{}".format(s3path, s3_additional_output, file_name)
     df = None
     try:
-        df = pd.read_csv(path, low_memory=False)
+        df = pd.read_csv(cached_path(path), low_memory=False)
     except HTTPError:
         print('File does not exist by path:', path)
 
@@ -1891,7 +1892,7 @@ def get_fake_real_walkers(s3url, iteration, threshold=2000):
 
     start_time = time.time()
     modechoice = pd.concat([df[(df['type'] == 'ModeChoice') | (df['type'] == 'Replanning')]
-                            for df in pd.read_csv(events_file_path, low_memory=False, chunksize=100000)])
+                            for df in pd.read_csv(cached_path(events_file_path), low_memory=False, chunksize=100000)])
     print("events file url:", events_file_path)
     print("loading took %s seconds" % (time.time() - start_time))
 
@@ -1943,7 +1944,7 @@ def print_spreadsheet_rows(s3urls, commit, iteration):
 
         s3path = get_output_path_from_s3_url(s3url)
         replanning_path = s3path + "/ITERS/it.{0}/{0}.replanningEventReason.csv".format(iteration)
-        replanning_reasons = pd.read_csv(replanning_path)
+        replanning_reasons = pd.read_csv(cached_path(replanning_path))
         print('\nreplanning_reasons:\n', replanning_reasons, '\n\n')
         walk_transit_exhausted = \
         replanning_reasons[replanning_reasons['ReplanningReason'] == 'ResourceCapacityExhausted WALK_TRANSIT'][
@@ -1972,7 +1973,7 @@ def print_spreadsheet_rows(s3urls, commit, iteration):
 
 nyc_volumes_benchmark_date = '2018-04-11'
 nyc_volumes_benchmark_raw = read_traffic_counts(
-    pd.read_csv('https://data.cityofnewyork.us/api/views/ertz-hr4r/rows.csv?accessType=DOWNLOAD'))
+    pd.read_csv(cached_path('https://data.cityofnewyork.us/api/views/ertz-hr4r/rows.csv?accessType=DOWNLOAD')))
 nyc_volumes_benchmark = aggregate_per_hour(nyc_volumes_benchmark_raw, nyc_volumes_benchmark_date)
 
 # from Zach
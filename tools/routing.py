@@ -1,10 +1,198 @@
+import re
+import time
+import weakref
+import numpy as np
+import pandas as pd
+
+from .cache import cached_path
+
+# person indices of routing request tables, by id of the table (see get_person_requests_index)
+person_requests_indices = {}
+
+# vehicle id is '<kind>-<number>' (i.e. 'body-123', 'rideHailVehicle-9') or just '<number>',
+# other ids (without a number at the end) are kept whole as the kind with number -1
+vehicle_id_pattern = re.compile(r'^(?:(.*)-)?(0|[1-9]\d*)$')
+
+
+def tokenize_vehicle_ids(vehicle_ids):
+    """
+    split vehicle ids into kind (category) and number (int32 or int64 for big numbers, -1 if there is no number).
+    only distinct ids are parsed, so it is fast for big tables.
+    """
+    codes, unique_ids = pd.factorize(vehicle_ids)
+    if len(unique_ids) == 0:
+        # the vehicle slot is never used
+        return pd.Categorical([np.nan] * len(codes), categories=[]), np.full(len(codes), -1, dtype=np.int32)
+
+    kinds = []
+    numbers = []
+    for vehicle_id in unique_ids:
+        match = vehicle_id_pattern.match(str(vehicle_id))
+        if match:
+            kinds.append(match.group(1) or '')
+            numbers.append(int(match.group(2)))
+        else:
+            kinds.append(str(vehicle_id))
+            numbers.append(-1)
+
+    kind_codes, kind_categories = pd.factorize(pd.Series(kinds, dtype=object))
+    # missing ids (code -1) stay missing kind and number -1
+    kind = pd.Categorical.from_codes(np.where(codes >= 0, kind_codes[codes], -1), categories=kind_categories)
+    number = np.where(codes >= 0, np.asarray(numbers, dtype=np.int64)[codes], -1)
+    if len(number) == 0 or number.max() <= np.iinfo(np.int32).max:
+        number = number.astype(np.int32)
+    return kind, number
+
+
+def get_vehicle_ids(req_df, vehicle_idx):
+    """
+    string ids of street vehicle number vehicle_idx of a typed request table (see load_routing_requests)
+    """
+    kind = req_df['streetVehicle_{}_kind'.format(vehicle_idx)].astype(object)
+    number = req_df['streetVehicle_{}_number'.format(vehicle_idx)]
+    number_str = number.astype(str).astype(object)
+    vehicle_ids = np.where(kind == '', number_str, kind + '-' + number_str)
+    vehicle_ids = np.where(number < 0, kind, vehicle_ids)
+    return pd.Series(vehicle_ids, index=req_df.index).where(kind.notna())
+
+
+def load_routing_requests(path, columns=None):
+    """
+    read routing requests (or responses) output of BEAM (csv or parquet, local or url) with compact types:
+    'streetVehicle_N_id' is split into 'streetVehicle_N_kind' (category) and 'streetVehicle_N_number' (int32),
+    'departureTime' is int32, coordinates (columns ending with '_X' or '_Y') are float32.
+    """
+    start_time = time.time()
+    local_path = cached_path(path)
+    if '.parquet' in path:
+        req_df = pd.read_parquet(local_path, columns=columns)
+    else:
+        header = pd.read_csv(local_path, nrows=0).columns
+        dtype = {col: np.float32 for col in header if col.endswith('_X') or col.endswith('_Y')}
+        dtype.update({col: str for col in header if re.fullmatch(r'streetVehicle_\d+_id', col)})
+        req_df = pd.read_csv(local_path, usecols=columns, dtype=dtype, low_memory=False)
+
+    typed_columns = {}
+    for col in req_df.columns:
+        vehicle_column = re.fullmatch(r'streetVehicle_(\d+)_id', col)
+        if vehicle_column:
+            kind, number = tokenize_vehicle_ids(req_df[col])
+            typed_columns['streetVehicle_{}_kind'.format(vehicle_column.group(1))] = kind
+            typed_columns['streetVehicle_{}_number'.format(vehicle_column.group(1))] = number
+        elif col == 'departureTime':
+            typed_columns[col] = req_df[col].astype(np.int32)
+        elif col.endswith('_X') or col.endswith('_Y'):
+            typed_columns[col] = req_df[col].astype(np.float32)
+        else:
+            typed_columns[col] = req_df[col]
+    req_df = pd.DataFrame(typed_columns, index=req_df.index)
+
+    print("routing requests:", path)
+    print("loading took %s seconds" % (time.time() - start_time))
+    return req_df
+
+
+def get_vehicle_indices(req_df):
+    """
+    numbers N of 'streetVehicle_N_id' (or 'streetVehicle_N_kind' of typed table) columns
+    """
+    return [int(match.group(1)) for match in
+            (re.fullmatch(r'streetVehicle_(\d+)_(?:id|kind)', col) for col in req_df.columns) if match]
+
+
+def get_vehicle_persons(req_df, vehicle_idx):
+    """
+    person ids and row positions of requests where street vehicle number vehicle_idx is a person or its vehicle:
+    'body-<person id>' or exactly '<person id>'. person ids are strings, or integers for typed table.
+    ids of typed table which are not a canonical integer (i.e. '0123' or 'body-2012000065238-0') and ids of
+    other vehicles are kept as strings, the same as for string table, so integer and string ids are mixed.
+    """
+    id_column = 'streetVehicle_{}_id'.format(vehicle_idx)
+    if id_column in req_df.columns:
+        vehicle_ids = req_df[id_column]
+        not_empty = vehicle_ids.notna().values
+        persons = vehicle_ids[not_empty].astype(str).str.replace(r'^body-', '', regex=True).values
+        return persons, np.flatnonzero(not_empty)
+
+    kind = req_df['streetVehicle_{}_kind'.format(vehicle_idx)]
+    number = req_df['streetVehicle_{}_number'.format(vehicle_idx)].values
+    is_person = (kind.isin(['body', '']).values) & (number >= 0)
+    is_other = kind.notna().values & ~is_person
+    if not is_other.any():
+        return number[is_person], np.flatnonzero(is_person)
+
+    other_ids = get_vehicle_ids(req_df[is_other], vehicle_idx).str.replace(r'^body-', '', regex=True)
+    persons = np.concatenate([number[is_person].astype(object), other_ids.values.astype(object)])
+    return persons, np.concatenate([np.flatnonzero(is_person), np.flatnonzero(is_other)])
+
+
+def build_person_requests_index(req_df):
+    """
+    positions of rows of routing requests by person id.
+    a request belongs to a person if one of its street vehicles is the person ('body-<person id>')
+    or has exactly the person id.
+    """
+    persons = []
+    positions = []
+    for vehicle_idx in get_vehicle_indices(req_df):
+        vehicle_persons, vehicle_positions = get_vehicle_persons(req_df, vehicle_idx)
+        persons.append(vehicle_persons)
+        positions.append(vehicle_positions)
+
+    person_positions = pd.DataFrame({'person': np.concatenate(persons), 'position': np.concatenate(positions)})
+    # the same person could be in several vehicle columns of one request
+    person_positions = person_positions.drop_duplicates(ignore_index=True)
+    return person_positions, person_positions.groupby('person', sort=False).indices
+
+
+def get_person_requests_index(req_df):
+    """
+    person index of req_df, built on the first call for that table.
+    if the table is changed in place the index should be rebuilt by build_person_requests_index.
+    """
+    key = id(req_df)
+    if key in person_requests_indices:
+        table_ref, index = person_requests_indices[key]
+        if table_ref() is req_df:
+            return index
+
+    index = build_person_requests_index(req_df)
+    person_requests_indices[key] = (weakref.ref(req_df, lambda _: person_requests_indices.pop(key, None)), index)
+    return index
+
+
+def get_person_keys(person_positions, person_ids):
+    """
+    person ids converted to the type of person ids of the index: strings, integers (ids which are not
+    a canonical integer are dropped) or both of them if the index of typed table has string ids too
+    """
+    person_ids = pd.Series(pd.unique(np.asarray(person_ids).astype(str)))
+    person_dtype = person_positions['person'].dtype
+    if pd.api.types.is_integer_dtype(person_dtype):
+        return person_ids[person_ids.str.fullmatch(r'0|[1-9]\d*')].astype(np.int64).values
+    if pd.api.types.is_object_dtype(person_dtype):
+        int_ids = person_ids[person_ids.str.fullmatch(r'0|[1-9]\d*')].astype(np.int64)
+        return np.concatenate([person_ids.values.astype(object), int_ids.values.astype(object)])
+    return person_ids.values
+
+
 def get_person_request(req_df, person_id):
-    street_vehicle_id = "body-%s" % (person_id)
-#     filtered_df = req_df[(req_df['streetVehicle_0_id'] == street_vehicle_id) | (req_df['streetVehicle_0_id'] == person_id) |
-#                          (req_df['streetVehicle_1_id'] == street_vehicle_id) | (req_df['streetVehicle_1_id'] == person_id) |
-#                          (req_df['streetVehicle_2_id'] == street_vehicle_id) | (req_df['streetVehicle_2_id'] == person_id)]
-    filtered_df = req_df[(req_df['streetVehicle_0_id'].str.contains(person_id)) |
-                         (req_df['streetVehicle_1_id'].str.contains(person_id)) |
-                         (req_df['streetVehicle_2_id'].str.contains(person_id))]
+    person_positions, person_indices = get_person_requests_index(req_df)
+    indices = [person_indices.get(person_key, []) for person_key in get_person_keys(person_positions, [person_id])]
+    positions = np.sort(person_positions['position'].values[np.concatenate([[]] + indices).astype(np.int64)])
+    filtered_df = req_df.iloc[positions]
     filtered_df = filtered_df.sort_values(by=['departureTime'])
-    return filtered_df
\ No newline at end of file
+    return filtered_df
+
+
+def get_persons_requests(req_df, person_ids):
+    """
+    routing requests of all persons from person_ids sorted by departureTime, with 'person' column added.
+    a request of several persons (i.e. a shared ride) is included once for each of them.
+    """
+    person_positions, _ = get_person_requests_index(req_df)
+    persons = pd.DataFrame({'person': get_person_keys(person_positions, person_ids)})
+    selected = persons.merge(person_positions, on='person').sort_values('position', kind='stable')
+    filtered_df = req_df.iloc[selected['position'].values].assign(person=selected['person'].values)
+    filtered_df = filtered_df.sort_values(by=['departureTime'], kind='stable')
+    return filtered_df